@@ -5,8 +5,13 @@ import axios from "axios";
 
 const PERIODS = ["daily", "weekly", "monthly", "yearly", "custom"];
 
+type Totals = { count: number; total: number; discount: number; profit: number };
+const EMPTY_TOTALS: Totals = { count: 0, total: 0, discount: 0, profit: 0 };
+
 export default function WholesaleReportPage() {
   const [data, setData] = useState<any[]>([]);
+  const [totals, setTotals] = useState<Totals>(EMPTY_TOTALS);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [period, setPeriod] = useState("daily");
@@ -25,7 +30,7 @@ export default function WholesaleReportPage() {
       .catch(() => setStaffList([]));
   }, []);
 
-  const fetchReport = async () => {
+  const fetchReport = async (cursor: string | null = null) => {
     setLoading(true);
     setError(null);
     try {
@@ -40,6 +45,9 @@ export default function WholesaleReportPage() {
       if (selectedStaff) {
         params.push(`user_id=${selectedStaff}`);
       }
+      if (cursor) {
+        params.push(`cursor=${encodeURIComponent(cursor)}`);
+      }
       const queryString = params.length ? `?${params.join("&")}` : "";
       const res = await axios.get(
         `${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/api/reports/wholesale/${queryString}`,
@@ -59,11 +67,15 @@ export default function WholesaleReportPage() {
         fetched = Array.isArray(res.data[period]) ? res.data[period] : [];
       }
 
-      setData(fetched);
+      setData((prev) => (cursor ? [...prev, ...fetched] : fetched));
+      setTotals(res.data?.totals || EMPTY_TOTALS);
+      setNextCursor(res.data?.next || null);
     } catch (err: any) {
       const errMsg = err?.response?.data?.detail || err.message || "Failed to fetch report.";
       setError(errMsg);
       setData([]);
+      setTotals(EMPTY_TOTALS);
+      setNextCursor(null);
     } finally {
       setLoading(false);
     }
@@ -105,9 +117,10 @@ export default function WholesaleReportPage() {
     printWindow.close();
   };
 
-  const totalAmount = data.reduce((sum, o) => sum + (o.total || 0), 0);
-  const totalDiscount = data.reduce((sum, o) => sum + (o.discount || 0), 0);
-  const totalProfit = data.reduce((sum, o) => sum + (o.profit || 0), 0);
+  // Totals cover the whole period, not just the rows loaded so far
+  const totalAmount = totals.total;
+  const totalDiscount = totals.discount;
+  const totalProfit = totals.profit;
 
   const isValidCustomRange = customStart && customEnd && customEnd >= customStart;
 
@@ -162,7 +175,7 @@ export default function WholesaleReportPage() {
             className="rounded px-3 py-1 border text-sm dark:bg-[#111] dark:text-white"
           />
           <button
-            onClick={fetchReport}
+            onClick={() => fetchReport()}
             disabled={!isValidCustomRange}
             className="px-4 py-1 bg-green-600 text-white rounded text-sm hover:bg-green-700 transition"
           >
@@ -247,6 +260,18 @@ export default function WholesaleReportPage() {
                 </table>
               </div>
 
+              {nextCursor && (
+                <div className="flex justify-center py-3">
+                  <button
+                    onClick={() => fetchReport(nextCursor)}
+                    disabled={loading}
+                    className="px-4 py-1 bg-green-600 text-white rounded text-sm hover:bg-green-700 transition"
+                  >
+                    Load more ({data.length} of {totals.count})
+                  </button>
+                </div>
+              )}
+
               {/* Fixed footer */}
               <table className="min-w-full text-sm text-left table-fixed">
                 <tfoot className="bg-gray-100 dark:bg-gray-800 text-gray-900 dark:text-white font-bold">
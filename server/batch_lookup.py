@@ -0,0 +1,131 @@
+"""Exact batch-code lookups for the scanner at the till.
+
+A small in-process LRU remembers which batch ids a scanned code belongs to,
+so a scan is a primary-key fetch (joined with its product) instead of a
+search over ``batch_code``. Quantities and prices are always read fresh;
+only the code -> id mapping is cached, and it is verified on every hit.
+
+Verification only notices ids that went away. New batches with a cached
+code are dropped from this process's cache when they are saved or bulk
+imported here (``forget``); ones created by another worker are picked up
+when the entry expires after ENTRY_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ProductBatch
+
+
+# How long another worker's new batch can stay unseen by a cached code
+ENTRY_TTL = 30
+
+SCAN_FIELDS = (
+    'id', 'batch_code', 'expiry_date', 'quantity', 'selling_price', 'wholesale_price',
+    'product_id', 'product__name',
+)
+
+
+class CodeCache:
+    def __init__(self, maxsize=4096, ttl=ENTRY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()    # code -> (expires, ids)
+        self._lock = threading.Lock()
+
+    def get_many(self, codes):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for code in codes:
+                entry = self._data.get(code)
+                if entry is None:
+                    continue
+                expires, ids = entry
+                if expires <= now:
+                    del self._data[code]
+                    continue
+                self._data.move_to_end(code)
+                found[code] = ids
+        return found
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for code, ids in mapping.items():
+                if code in self._data and self._data[code][1] == ids:
+                    # Confirmed unchanged: keep the expiry, so new batches still show up in time
+                    self._data.move_to_end(code)
+                    continue
+                self._data[code] = (expires, ids)
+                self._data.move_to_end(code)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, *codes):
+        with self._lock:
+            for code in codes:
+                self._data.pop(code, None)
+
+
+code_cache = CodeCache()
+
+
+def resolve(codes):
+    """Return ``{code: [batch rows]}`` for ``codes`` with one query.
+
+    Codes that match no batch map to an empty list.
+    """
+    codes = list(dict.fromkeys(c.strip() for c in codes if c and c.strip()))
+    if not codes:
+        return {}
+
+    known = code_cache.get_many(codes)
+    unknown = [code for code in codes if code not in known]
+    known_ids = {batch_id for ids in known.values() for batch_id in ids}
+
+    condition = Q(id__in=known_ids) | Q(batch_code__in=unknown)
+
+    result = {code: [] for code in codes}
+    for row in ProductBatch.objects.filter(condition).order_by('expiry_date', 'id').values(*SCAN_FIELDS):
+        if row['batch_code'] in result:
+            result[row['batch_code']].append(row)
+
+    # A cached mapping that no longer matches (code edited, batch deleted)
+    # is dropped and looked up again by code.
+    stale = [
+        code for code, ids in known.items()
+        if {row['id'] for row in result[code]} != set(ids)
+    ]
+    if stale:
+        code_cache.discard(*stale)
+        for row in ProductBatch.objects.filter(batch_code__in=stale).order_by('expiry_date', 'id').values(*SCAN_FIELDS):
+            if row not in result[row['batch_code']]:
+                result[row['batch_code']].append(row)
+
+    code_cache.set_many({
+        code: tuple(row['id'] for row in rows)
+        for code, rows in result.items() if rows
+    })
+    return result
+
+
+def forget(*codes):
+    """Drop ``codes`` from the cache once the current transaction commits (new or deleted batches)."""
+    codes = [code for code in codes if code]
+    if codes:
+        transaction.on_commit(lambda: code_cache.discard(*codes))
+
+
+@receiver(post_save, sender=ProductBatch)
+@receiver(post_delete, sender=ProductBatch)
+def _batch_changed(sender, instance, created=False, **kwargs):
+    # New batches can share a code with a cached one; deletes free a code.
+    # Edited codes are caught by the verification in resolve().
+    if created or kwargs.get('signal') is post_delete:
+        forget(instance.batch_code)
@@ -0,0 +1,136 @@
+"""Run independent, read-only ORM work concurrently.
+
+Tasks run on a small pool of long-lived threads shared by every request of
+the process (``FAN_OUT_POOL_SIZE`` threads, default 8). Django keeps one
+database connection per thread, so each pool thread keeps its own
+connection open between tasks instead of connecting for every task; it is
+closed when the thread exits (at process shutdown), after a task fails
+with a database error, or when it turns out to be dead after sitting idle.
+The calling thread works through one share of the tasks itself.
+
+Tasks must not rely on uncommitted data of the calling request's
+transaction.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_POOL_SIZE = 8
+# Connections idle longer than this are pinged before the next task
+IDLE_CHECK_SECONDS = 60
+
+_local = threading.local()
+
+
+def _close_dead_connections():
+    for conn in connections.all():
+        if conn.connection is not None and not conn.is_usable():
+            conn.close()
+
+
+class WorkerPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive fork(): every worker process starts its own
+            size = getattr(settings, 'FAN_OUT_POOL_SIZE', DEFAULT_POOL_SIZE)
+            self._queue = queue.SimpleQueue()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"fan-out-{i}", daemon=True)
+                for i in range(max(1, size))
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, fn):
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((future, fn))
+        return future
+
+    def _work(self):
+        _local.in_pool = True
+        work = self._queue
+        last_used = time.monotonic()
+        try:
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+                future, fn = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if time.monotonic() - last_used > IDLE_CHECK_SECONDS:
+                    _close_dead_connections()
+                try:
+                    result = fn()
+                except BaseException as exc:
+                    if isinstance(exc, DatabaseError):
+                        # Don't hand a possibly broken connection to the next task
+                        connections.close_all()
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+                last_used = time.monotonic()
+        finally:
+            connections.close_all()
+
+    def shutdown(self, timeout=5):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+            self._pid = None
+
+
+pool = WorkerPool()
+atexit.register(pool.shutdown)
+
+
+def _run_lane(tasks, names):
+    return {name: tasks[name]() for name in names}
+
+
+def fan_out(tasks, max_workers=DEFAULT_MAX_WORKERS, parallel=True):
+    """Run ``{name: callable}`` and return ``{name: result}``.
+
+    At most ``max_workers`` of the tasks run at the same time, the calling
+    thread being one of them. With ``parallel=False`` the tasks run one
+    after another in the calling thread, which is what the views did before
+    and is handy for comparison; calls made from a pool thread do the same,
+    so nested fan-outs can't wait on a pool they are holding.
+    Exceptions raised by a task propagate to the caller.
+    """
+    if not parallel or len(tasks) <= 1 or getattr(_local, 'in_pool', False):
+        return {name: task() for name, task in tasks.items()}
+
+    names = list(tasks)
+    workers = max(1, min(max_workers, len(names)))
+    lanes = [names[i::workers] for i in range(workers)]
+    futures = [pool.submit(lambda lane=lane: _run_lane(tasks, lane)) for lane in lanes[1:]]
+
+    results = _run_lane(tasks, lanes[0])
+    for future in futures:
+        results.update(future.result())
+    return {name: results[name] for name in names}
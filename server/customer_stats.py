@@ -0,0 +1,88 @@
+"""Per-customer lifetime aggregates for the customer profile.
+
+Lifetime spend, visit count, last purchase and outstanding loan balance are
+kept per customer in the derived-data cache (see ``shared_cache``), so every
+worker sees the same entry. Writes to Sale, Payment and Refund drop the
+affected customer's entry once the transaction commits, and the next read
+recomputes it with a single aggregate over that customer's sales, so the
+profile never has to walk the line items.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Count, Max, Q, F, ExpressionWrapper, DecimalField
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Sale, Payment, Refund
+from .shared_cache import cache
+
+
+STATS_KEY = "customer-stats:{}"
+
+
+def compute(customer_id):
+    valid_q = ~Q(status='refunded')
+    # Same rows the loans screen lists as open
+    open_loan_q = valid_q & Q(is_loan=True) & ~Q(payment_status='paid')
+    remaining = ExpressionWrapper(
+        F('final_amount') - F('paid_amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+    totals = Sale.objects.filter(customer_id=customer_id).aggregate(
+        lifetime_spend=Sum('paid_amount', filter=valid_q),
+        visit_count=Count('id', filter=valid_q),
+        last_purchase=Max('date', filter=valid_q),
+        outstanding_loan=Sum(remaining, filter=open_loan_q),
+    )
+    return {
+        "lifetime_spend": totals['lifetime_spend'] or Decimal("0.00"),
+        "visit_count": totals['visit_count'] or 0,
+        "last_purchase": totals['last_purchase'],
+        "outstanding_loan": totals['outstanding_loan'] or Decimal("0.00"),
+    }
+
+
+def customer_stats(customer_id):
+    """Lifetime aggregates of one customer (computed on a cache miss)."""
+    key = STATS_KEY.format(customer_id)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute(customer_id)
+        cache.set(key, stats, timeout=None)
+    return stats
+
+
+def invalidate(*customer_ids):
+    """Drop the aggregates of ``customer_ids`` once the transaction commits."""
+    keys = [STATS_KEY.format(cid) for cid in customer_ids if cid]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_init, sender=Sale)
+def _remember_customer(sender, instance, **kwargs):
+    # __dict__ so a deferred customer_id doesn't trigger a query per instance
+    instance._stats_customer_id = instance.__dict__.get('customer_id')
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def _sale_changed(sender, instance, **kwargs):
+    # A sale moved to another customer changes both profiles
+    invalidate(instance.customer_id, getattr(instance, '_stats_customer_id', None))
+    # __dict__ so a deferred customer_id doesn't trigger a query per instance
+    instance._stats_customer_id = instance.__dict__.get('customer_id')
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Refund)
+@receiver(post_delete, sender=Refund)
+def _sale_child_changed(sender, instance, **kwargs):
+    try:
+        sale = instance.sale
+    except Sale.DoesNotExist:
+        return
+    invalidate(sale.customer_id)
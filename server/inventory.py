@@ -0,0 +1,149 @@
+"""Every change to batch stock goes through here.
+
+Each call takes many ``(batch, quantity)`` lines and applies them with one
+UPDATE (``quantity = quantity + CASE id ... END``), so concurrent writers
+never overwrite each other's read-modify-write. Decreases are guarded in
+the same statement: if any batch would go negative nothing is changed and
+``InsufficientStock`` is raised. The matching StockEntry ledger rows are
+written with one insert.
+
+Queryset updates and bulk inserts send no model signals, so the derived
+stock data (valuation counters, low-stock set, report cache) is moved here
+instead. The passed batch instances get their new quantities back.
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q, IntegerField
+from rest_framework.exceptions import ValidationError
+
+from . import lowstock, report_cache, valuation
+from .models import ProductBatch, StockEntry
+
+
+class InsufficientStock(ValidationError):
+    def __init__(self, batch_ids):
+        self.batch_ids = sorted(batch_ids)
+        super().__init__({"detail": "Not enough stock.", "batches": self.batch_ids})
+
+
+def _collect(lines):
+    """Merge the lines per batch: ``({batch_id: quantity}, {batch_id: batch})``."""
+    deltas = defaultdict(int)
+    batches = {}
+    for batch, quantity in lines:
+        quantity = int(quantity)
+        if not quantity:
+            continue
+        deltas[batch.pk] += quantity
+        batches[batch.pk] = batch
+    return {pk: q for pk, q in deltas.items() if q}, batches
+
+
+def _apply(lines, user, sign, entry_type):
+    deltas, batches = _collect(lines)
+    if not deltas:
+        return {}
+    deltas = {pk: sign * quantity for pk, quantity in deltas.items()}
+
+    with transaction.atomic():
+        # Decreases only apply where the stock is there
+        guards = [Q(id=pk, quantity__gte=-delta) for pk, delta in deltas.items() if delta < 0]
+        guards += [Q(id=pk) for pk, delta in deltas.items() if delta > 0]
+
+        with transaction.atomic():
+            updated = ProductBatch.objects.filter(reduce(or_, guards)).update(
+                quantity=F('quantity') + Case(
+                    *[When(id=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+            short = updated != len(deltas)
+            if short:
+                transaction.set_rollback(True)
+
+        if short:
+            # Rolled back to the savepoint: find the batches that can't cover their decrease
+            available = set(ProductBatch.objects.filter(reduce(or_, guards)).values_list('id', flat=True))
+            raise InsufficientStock(set(deltas) - available or deltas)
+
+        if entry_type:
+            StockEntry.objects.bulk_create([
+                StockEntry(
+                    product_id=batches[pk].product_id,
+                    batch_id=pk,
+                    entry_type=entry_type(delta) if callable(entry_type) else entry_type,
+                    quantity=abs(delta),
+                    recorded_by=user,
+                )
+                for pk, delta in deltas.items()
+            ])
+
+        valuation.apply_delta(
+            quantity=sum(deltas.values()),
+            buying=sum(delta * (batches[pk].buying_price or 0) for pk, delta in deltas.items()),
+            selling=sum(delta * (batches[pk].selling_price or 0) for pk, delta in deltas.items()),
+        )
+        lowstock.schedule_recheck(*{batch.product_id for batch in batches.values()})
+        report_cache.bump('stock')
+
+    current = dict(ProductBatch.objects.filter(id__in=deltas).values_list('id', 'quantity'))
+    for pk, batch in batches.items():
+        batch.quantity = current.get(pk, batch.quantity)
+        # The delta is already counted; a later save() of this instance must not count it again
+        valuation.remember(batch)
+    return current
+
+
+def receive(lines, user):
+    """New stock in (purchases, new batches).
+
+    An unsaved batch is inserted with the line's quantity: nobody else can
+    hold a row that doesn't exist yet, so that is a plain save (its signals
+    move the derived data) plus its 'added' ledger row, not an insert at
+    zero followed by an update.
+    """
+    lines = list(lines)
+    new = [(batch, int(quantity)) for batch, quantity in lines if batch.pk is None]
+    existing = [(batch, quantity) for batch, quantity in lines if batch.pk is not None]
+
+    with transaction.atomic():
+        for batch, quantity in new:
+            batch.quantity = quantity
+            batch.save()
+        StockEntry.objects.bulk_create([
+            StockEntry(
+                product_id=batch.product_id,
+                batch_id=batch.pk,
+                entry_type='added',
+                quantity=quantity,
+                recorded_by=user,
+            )
+            for batch, quantity in new if quantity
+        ])
+        current = _apply(existing, user, 1, 'added')
+    current.update((batch.pk, batch.quantity) for batch, _ in new)
+    return current
+
+
+def restore(lines, user):
+    """Sold stock coming back (refunds)."""
+    return _apply(lines, user, 1, 'returned')
+
+
+def issue(lines, user, entry_type=None):
+    """Stock going out. Sales are recorded by their items, so no ledger row unless ``entry_type`` is given."""
+    return _apply(lines, user, -1, entry_type)
+
+
+def write_off(lines, user):
+    """Stock removed from the shelf (deleted batches and products, reversed refunds)."""
+    return _apply(lines, user, -1, 'deleted')
+
+
+def adjust(lines, user):
+    """Corrections by signed quantity, logged as 'added' or 'deleted'."""
+    return _apply(lines, user, 1, lambda delta: 'added' if delta > 0 else 'deleted')
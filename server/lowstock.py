@@ -0,0 +1,205 @@
+"""The low-stock watcher.
+
+The set of products at or below their threshold (with their available
+quantity) is kept in the shared derived-data cache (see ``shared_cache``),
+so the stock report never has to group the whole catalog. Batch and
+product writes recheck only the products they touch. Every time a product
+crosses its threshold an event is appended to a numbered feed that clients
+can poll with ``?since=<seq>``.
+
+The set is one cache entry, so every read-modify-write of it happens under
+a short lock (``cache.add``), with the product rows read inside the lock.
+A writer that can't get the lock in time bumps the set's generation
+instead, so whatever the lock holder stores is discarded and rebuilt on
+the next read rather than silently missing that writer's change.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Sum, F
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductBatch
+from .shared_cache import cache, seed
+
+
+LOW_SET_KEY = "low-stock:products"
+GENERATION_KEY = "low-stock:generation"
+LOCK_KEY = "low-stock:lock"
+SEQ_KEY = "low-stock:seq"
+EVENT_KEY = "low-stock:event:{}"
+
+# The low-stock set is also rebuilt from scratch once it expires, which
+# bounds drift from writes that bypass the signals below.
+LOW_SET_TIMEOUT = 60 * 60
+EVENT_TIMEOUT = 7 * 24 * 60 * 60
+FEED_LIMIT = 200
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+
+
+def _low_stock_rows(product_ids=None):
+    qs = Product.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(id__in=product_ids)
+    return qs.annotate(
+        total_stock=Coalesce(Sum('batches__quantity'), 0)
+    ).values('id', 'name', 'threshold', 'total_stock')
+
+
+@contextmanager
+def _locked():
+    """Yield True while holding the low-stock lock, False if it couldn't be had within LOCK_WAIT."""
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, seed(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, seed(), timeout=None)
+
+
+def rebuild():
+    """Recompute the low-stock set with one grouped query."""
+    with _locked() as held:
+        generation = _generation()
+        low = {
+            row['id']: row
+            for row in _low_stock_rows().filter(total_stock__lte=F('threshold'))
+        }
+        if held:
+            cache.set(LOW_SET_KEY, {"generation": generation, "rows": low}, timeout=LOW_SET_TIMEOUT)
+    return low
+
+
+def low_stock_products():
+    """Products at or below their threshold, as the stock report lists them."""
+    found = cache.get_many([LOW_SET_KEY, GENERATION_KEY])
+    stored = found.get(LOW_SET_KEY)
+    if stored is not None and stored["generation"] == found.get(GENERATION_KEY):
+        low = stored["rows"]
+    else:
+        low = rebuild()
+    return sorted(low.values(), key=lambda row: row['id'])
+
+
+def _next_seq():
+    try:
+        return cache.incr(SEQ_KEY)
+    except ValueError:
+        # Restarting from the clock sends clients that are behind a resync
+        cache.add(SEQ_KEY, seed(), timeout=None)
+        try:
+            return cache.incr(SEQ_KEY)
+        except ValueError:
+            return None           # no cache at all (DummyCache): no feed
+
+
+def _record_event(row, state):
+    seq = _next_seq()
+    if seq is None:
+        return
+    cache.set(EVENT_KEY.format(seq), {
+        "seq": seq,
+        "product_id": row['id'],
+        "name": row['name'],
+        "threshold": row['threshold'],
+        "total_stock": row['total_stock'],
+        "state": state,
+        "at": timezone.now().isoformat(),
+    }, timeout=EVENT_TIMEOUT)
+
+
+def recheck(product_ids):
+    """Refresh ``product_ids`` in the low-stock set and record threshold crossings."""
+    product_ids = set(product_ids)
+    with _locked() as held:
+        if not held:
+            _bump_generation()
+            return
+
+        generation = _generation()
+        stored = cache.get(LOW_SET_KEY)
+        if stored is None or stored["generation"] != generation:
+            # Nothing current to compare against; the next read rebuilds it
+            return
+
+        low = stored["rows"]
+        rows = {row['id']: row for row in _low_stock_rows(product_ids)}
+        for product_id in product_ids:
+            row = rows.get(product_id)
+            was_low = product_id in low
+            if row is None:
+                # Product deleted
+                low.pop(product_id, None)
+                continue
+
+            is_low = row['total_stock'] <= row['threshold']
+            if is_low:
+                low[product_id] = row
+            else:
+                low.pop(product_id, None)
+            if is_low != was_low:
+                _record_event(row, "low" if is_low else "restocked")
+
+        cache.set(LOW_SET_KEY, {"generation": generation, "rows": low}, timeout=LOW_SET_TIMEOUT)
+
+
+def schedule_recheck(*product_ids):
+    """Recheck ``product_ids`` once the current transaction commits."""
+    ids = [pid for pid in product_ids if pid]
+    if ids:
+        transaction.on_commit(lambda: recheck(ids))
+
+
+def feed(since=0):
+    """Threshold crossings newer than ``since``, oldest first: ``(latest, events, resync)``.
+
+    ``resync`` is True when the client can't catch up from the feed alone
+    (it is more than FEED_LIMIT events behind, some of its events have
+    expired, or the counter was reset) and should reload the low-stock list.
+    """
+    latest = cache.get(SEQ_KEY) or 0
+    first = max(since + 1, latest - FEED_LIMIT + 1, 1)
+    keys = [EVENT_KEY.format(seq) for seq in range(first, latest + 1)]
+    found = cache.get_many(keys)
+    events = [found[key] for key in keys if key in found]
+    resync = since > latest or first > since + 1 or len(events) != len(keys)
+    return latest, events, resync
+
+
+@receiver(post_save, sender=ProductBatch)
+@receiver(post_delete, sender=ProductBatch)
+def _batch_changed(sender, instance, **kwargs):
+    schedule_recheck(instance.product_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _product_changed(sender, instance, **kwargs):
+    schedule_recheck(instance.pk)
@@ -0,0 +1,64 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ...views import StockReportAPIView
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare p50/p95 latency of StockReportAPIView under concurrent load with "
+        "its report sections run sequentially vs. fanned out over a thread pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--period', default='monthly')
+        parser.add_argument('--username', help="User to authenticate as (defaults to the first admin).")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(role='admin').first() or User.objects.first()
+        if user is None:
+            raise CommandError("No user to authenticate as.")
+
+        factory = APIRequestFactory()
+        view = StockReportAPIView.as_view()
+        original = StockReportAPIView.parallel_queries
+
+        def call(i):
+            # A unique parameter per call keeps the report cache out of the measurement
+            request = factory.get('/api/reports/summary/stock/', {'period': options['period'], '_bench': i})
+            force_authenticate(request, user=user)
+            started = time.perf_counter()
+            try:
+                response = view(request)
+                response.render()
+            finally:
+                connections.close_all()
+            return (time.perf_counter() - started) * 1000
+
+        try:
+            for label, parallel in (("sequential", False), ("fan-out", True)):
+                StockReportAPIView.parallel_queries = parallel
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                    latencies = sorted(pool.map(call, range(options['requests'])))
+                elapsed = time.perf_counter() - started
+
+                p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+                self.stdout.write(
+                    f"{label:>10}: p50={statistics.median(latencies):8.1f}ms "
+                    f"p95={p95:8.1f}ms  throughput={len(latencies) / elapsed:6.1f} req/s"
+                )
+        finally:
+            StockReportAPIView.parallel_queries = original
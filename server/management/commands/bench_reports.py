@@ -0,0 +1,149 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ... import shared_cache
+from ...models import Sale
+from ...views import (
+    ProfitReportView, ReportSummaryAPIView, ShortReportView, StockEntryViewSet,
+    StockReportAPIView, WholesaleReportAPIView, customer_purchases,
+)
+
+
+def _cases(customer_id):
+    """(name, view, path, params, view kwargs) for every benchmarked endpoint."""
+    today = timezone.localdate()
+    year_start = today.replace(month=1, day=1)
+    cases = []
+    for period in ('daily', 'weekly', 'monthly', 'yearly'):
+        cases += [
+            (f"summary:{period}", ReportSummaryAPIView.as_view(), '/api/reports/summary/', {'period': period}, {}),
+            (f"stock:{period}", StockReportAPIView.as_view(), '/api/reports/summary/stock/', {'period': period}, {}),
+            (f"profit:{period}", ProfitReportView.as_view(), '/api/reports/profit/', {'period': period}, {}),
+            (f"wholesale:{period}", WholesaleReportAPIView.as_view(), '/api/reports/wholesale/', {'period': period}, {}),
+        ]
+    cases += [
+        ("short:ytd", ShortReportView.as_view(), '/api/reports/short/',
+         {'start': year_start.isoformat(), 'end': today.isoformat()}, {}),
+        ("stock-entries:page", StockEntryViewSet.as_view({'get': 'list'}), '/api/stock-entries/', {'page_size': 100}, {}),
+        ("stock-entries:search", StockEntryViewSet.as_view({'get': 'list'}), '/api/stock-entries/',
+         {'search': 'amoxi', 'page_size': 100}, {}),
+    ]
+    if customer_id:
+        cases.append(("customer-purchases", customer_purchases, f'/api/customers/{customer_id}/purchases/', {},
+                      {'customer_id': customer_id}))
+    return cases
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every report and list endpoint and count its SQL queries. "
+        "Save the results with --output and compare a later run with --baseline "
+        "to catch regressions between releases. Seed data first (seed_pharmacy)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--only', help="Comma-separated case name prefixes, e.g. summary,stock.")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every call (rollups, counters, report cache).")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--baseline', help="JSON from an earlier --output to compare against.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed slowdown of the median before it counts as a regression (0.25 = 25%%).")
+        parser.add_argument('--username', help="User to authenticate as (defaults to the first admin).")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(role='admin').first() or User.objects.first()
+        if user is None:
+            raise CommandError("No user to authenticate as.")
+
+        # The customer with the longest history is the worst case for the profile
+        customer = (
+            Sale.objects.exclude(customer=None).values('customer_id')
+            .annotate(n=Count('id')).order_by('-n')
+            .values_list('customer_id', flat=True).first()
+        )
+        cases = _cases(customer)
+        if options['only']:
+            prefixes = tuple(p.strip() for p in options['only'].split(',') if p.strip())
+            cases = [case for case in cases if case[0].startswith(prefixes)]
+
+        factory = APIRequestFactory()
+        # Sections fanned out to threads use their own connections, which the
+        # query counter can't see: run them inline while measuring.
+        parallel = StockReportAPIView.parallel_queries
+        StockReportAPIView.parallel_queries = False
+        results = {}
+        try:
+            for name, view, path, params, kwargs in cases:
+                timings, queries = [], []
+                for i in range(options['repeat']):
+                    if options['cold']:
+                        shared_cache.cache.clear()
+                    # A unique parameter per call keeps the response cache out of the measurement
+                    request = factory.get(path, {**params, '_bench': f"{time.time_ns()}-{i}"})
+                    force_authenticate(request, user=user)
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = view(request, **kwargs)
+                        if hasattr(response, 'render'):
+                            response.render()
+                        if getattr(response, 'streaming', False):
+                            for _ in response.streaming_content:
+                                pass
+                        timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code >= 400:
+                        raise CommandError(f"{name}: HTTP {response.status_code}")
+                    queries.append(len(captured))
+
+                results[name] = {
+                    "median_ms": round(statistics.median(timings), 2),
+                    "max_ms": round(max(timings), 2),
+                    "queries": max(queries),
+                }
+                self.stdout.write(
+                    f"{name:<24} median={results[name]['median_ms']:9.1f}ms "
+                    f"max={results[name]['max_ms']:9.1f}ms queries={results[name]['queries']:4d}"
+                )
+        finally:
+            StockReportAPIView.parallel_queries = parallel
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({"cold": options['cold'], "results": results}, f, indent=2, sort_keys=True)
+            self.stdout.write(f"results written to {options['output']}")
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = []
+        for name, current in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if current["queries"] > before["queries"]:
+                regressions.append(f"{name}: queries {before['queries']} -> {current['queries']}")
+            if current["median_ms"] > before["median_ms"] * (1 + tolerance):
+                regressions.append(f"{name}: median {before['median_ms']}ms -> {current['median_ms']}ms")
+
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f"{len(regressions)} regression(s) against {path}.")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}."))
@@ -0,0 +1,85 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ...models import ProductBatch, StockEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Time StockEntry pages at increasing depth with keyset (date, id) seeks "
+        "versus OFFSET paging. Optionally seed the ledger first (--seed N)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Add this many synthetic stock entries first.")
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--product', type=int, help="Also filter by this product id.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+
+        qs = StockEntry.objects.all()
+        if options['product']:
+            qs = qs.filter(product_id=options['product'])
+        qs = qs.order_by('-date', '-id')
+
+        total = qs.count()
+        if total == 0:
+            raise CommandError("The stock ledger is empty; use --seed.")
+        size = options['page_size']
+        self.stdout.write(f"{total} entries, page size {size}")
+        self.stdout.write(f"{'depth':>10} {'keyset ms':>10} {'offset ms':>10}")
+
+        depth = 0
+        while depth < total:
+            # The (date, id) of the last row of the previous page is what a cursor carries
+            anchor = qs.values_list('date', 'id')[depth - 1] if depth else None
+
+            keyset = self.timed(lambda: list(
+                (qs.filter(Q(date__lt=anchor[0]) | Q(date=anchor[0], id__lt=anchor[1])) if anchor else qs)
+                .values_list('id', flat=True)[:size]
+            ), options['repeat'])
+            offset = self.timed(lambda: list(qs.values_list('id', flat=True)[depth:depth + size]), options['repeat'])
+
+            self.stdout.write(f"{depth:>10} {keyset:>10.2f} {offset:>10.2f}")
+            depth = depth * 10 if depth else size
+
+    def timed(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def seed(self, count):
+        batches = list(ProductBatch.objects.values_list('id', 'product_id')[:5000])
+        user = get_user_model().objects.order_by('id').first()
+        if not batches or user is None:
+            raise CommandError("Seeding needs at least one product batch and one user.")
+
+        chunk = 10000
+        created = 0
+        while created < count:
+            n = min(chunk, count - created)
+            entries = []
+            for _ in range(n):
+                batch_id, product_id = random.choice(batches)
+                entries.append(StockEntry(
+                    product_id=product_id,
+                    batch_id=batch_id,
+                    entry_type=random.choice(['added', 'added', 'returned', 'deleted']),
+                    quantity=random.randint(1, 200),
+                    recorded_by=user,
+                ))
+            StockEntry.objects.bulk_create(entries, batch_size=2000)
+            created += n
+            self.stdout.write(f"seeded {created}/{count}", ending="\r")
+        self.stdout.write("")
@@ -0,0 +1,79 @@
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Min
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ...models import Order, ProductBatch
+from ...views import OrderViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Confirm pending orders from several threads at once, report confirms per "
+        "second and check that no ProductBatch quantity went negative. "
+        "Run it against a disposable database (e.g. one seeded with seed_pharmacy)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help="Maximum number of pending orders to confirm.")
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--payload', default='{}', help="JSON body sent to the confirm action.")
+        parser.add_argument('--username', help="Cashier/admin to confirm as (defaults to the first admin).")
+
+    def handle(self, *args, **options):
+        try:
+            payload = json.loads(options['payload'])
+        except ValueError as e:
+            raise CommandError(f"--payload is not valid JSON: {e}")
+
+        User = get_user_model()
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(role='admin').first()
+        if user is None:
+            raise CommandError("No cashier/admin user to confirm as.")
+
+        order_ids = list(
+            Order.objects.filter(status='pending')
+            .order_by('id')
+            .values_list('id', flat=True)[:options['orders']]
+        )
+        if not order_ids:
+            raise CommandError("No pending orders to confirm.")
+
+        factory = APIRequestFactory()
+        view = OrderViewSet.as_view({'post': 'confirm'})
+
+        def confirm(order_id):
+            request = factory.post(f'/api/orders/{order_id}/confirm/', payload, format='json')
+            force_authenticate(request, user=user)
+            try:
+                return view(request, pk=order_id).status_code
+            except Exception as e:
+                return type(e).__name__
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            results = Counter(pool.map(confirm, order_ids))
+        elapsed = time.perf_counter() - started
+
+        confirmed = results.get(201, 0)
+        self.stdout.write(f"orders attempted: {len(order_ids)} in {elapsed:.2f}s")
+        self.stdout.write(f"confirmed: {confirmed} ({confirmed / elapsed:.1f} confirms/s)")
+        for outcome, count in sorted(results.items(), key=str):
+            self.stdout.write(f"  {outcome}: {count}")
+
+        negative = ProductBatch.objects.filter(quantity__lt=0)
+        if negative.exists():
+            lowest = negative.aggregate(lowest=Min('quantity'))['lowest']
+            raise CommandError(f"{negative.count()} batch(es) went negative (lowest quantity {lowest}).")
+        self.stdout.write(self.style.SUCCESS("No batch quantity went negative."))
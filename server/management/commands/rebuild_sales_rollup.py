@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from ... import rollups, shared_cache
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cached daily and monthly sales rollup from the Sale table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD). Defaults to the first sale.")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD). Defaults to today.")
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start']) if options['start'] else None
+        end = parse_date(options['end']) if options['end'] else None
+        if options['start'] and start is None or options['end'] and end is None:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+        if not shared_cache.is_shared():
+            # A local-memory cache lives and dies with this command
+            raise CommandError("The derived-data cache is local to this process (use Redis, Memcached, a database or file cache); the server would never see the rebuilt rollup.")
+
+        days = rollups.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollup for {days} day(s)."))
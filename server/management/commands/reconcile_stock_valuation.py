@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import shared_cache, valuation
+
+
+class Command(BaseCommand):
+    help = "Recompute the running stock valuation counters and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail-on-drift', action='store_true',
+            help="Exit with a non-zero status when drift is found (for cron/monitoring).",
+        )
+
+    def handle(self, *args, **options):
+        if not shared_cache.is_shared():
+            # A local-memory cache lives and dies with this command
+            raise CommandError("The derived-data cache is local to this process (use Redis, Memcached, a database or file cache); the server's counters can't be reconciled from here.")
+
+        drift = valuation.reconcile()
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Stock valuation counters are in sync."))
+            return
+
+        for key, delta in drift.items():
+            self.stdout.write(self.style.WARNING(f"{key}: off by {delta}"))
+        self.stdout.write("Counters have been reset from ProductBatch.")
+
+        if options['fail_on_drift']:
+            raise SystemExit(1)
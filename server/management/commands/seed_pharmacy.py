@@ -0,0 +1,344 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ... import lowstock, report_cache, rollups, search_index, shared_cache, valuation
+from ...models import (
+    Category, Customer, Expense, Order, Payment, Product, ProductBatch,
+    Refund, Sale, SaleItem, StockEntry,
+)
+
+
+CATEGORIES = ["Antibiotics", "Analgesics", "Antimalarials", "Vitamins", "Antihypertensives",
+              "Antidiabetics", "Dermatology", "Cough & Cold", "First Aid", "Baby Care"]
+NAME_PARTS = ["Amoxi", "Para", "Ibu", "Metro", "Cipro", "Arte", "Lumi", "Azi", "Doxy", "Cetri",
+              "Lorat", "Ome", "Panto", "Ami", "Losa", "Nife", "Metfo", "Gliben", "Predni", "Dexa"]
+SUFFIXES = ["cillin", "cetamol", "profen", "nidazole", "floxacin", "mether", "fantrine", "thromycin",
+            "cycline", "rizine", "tadine", "prazole", "lodipine", "rtan", "dipine", "rmin", "clamide", "solone"]
+FORMS = ["250mg Caps", "500mg Tabs", "100ml Syrup", "20g Cream", "5ml Drops", "1g Sachet"]
+EXPENSE_CATEGORIES = ["rent", "electricity", "salary", "inventory", "misc"]
+
+CHUNK = 2000
+# Sales are generated and written this many at a time, so millions fit in memory
+SALES_PER_ROUND = 10000
+# Confirmed sales remembered for linking orders
+ORDER_SALE_POOL = 50000
+
+
+def _fit(model, **values):
+    """Build ``model``, failing loudly if the schema lacks any of the fields."""
+    names = {f.attname for f in model._meta.concrete_fields} | {f.name for f in model._meta.concrete_fields}
+    unknown = sorted(set(values) - names)
+    if unknown:
+        raise CommandError(f"{model.__name__} has no field(s) {', '.join(unknown)}; update the seeder for this schema.")
+    return model(**values)
+
+
+@contextmanager
+def _backdating(*fields):
+    """Let bulk_create keep explicit dates on auto_now/auto_now_add fields."""
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f, _, _ in saved:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def _date_fields(*pairs):
+    fields = []
+    for model, name in pairs:
+        try:
+            fields.append(model._meta.get_field(name))
+        except Exception:
+            continue
+    return fields
+
+
+def _money(value):
+    return Decimal(value).quantize(Decimal("0.01"))
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic pharmacy dataset: products with several batches, customers, "
+        "sales (retail/wholesale, loans with partial payments, refunds), orders in every "
+        "state, expenses and the matching stock ledger. Scales with --sales (10k to millions). "
+        "Writes straight to the database with bulk inserts; use a disposable database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365, help="History spread over this many days back from today.")
+        parser.add_argument('--products', type=int, help="Default: sales / 50 (at least 200, at most 20000).")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed, for reproducible datasets.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.today = timezone.localdate()
+        self.days = max(1, options['days'])
+        sales = options['sales']
+        products = options['products'] or min(20000, max(200, sales // 50))
+        if not shared_cache.is_shared():
+            # A local-memory cache lives and dies with this command
+            raise CommandError("The derived-data cache is local to this process (use Redis, Memcached, a database or file cache); the server would never see the rebuilt data.")
+
+        self.stdout.write(f"seeding {products} products and {sales} sales over {self.days} days")
+        self.users = self.seed_users()
+        self.customers = self.seed_customers(max(100, sales // 100))
+        self.batches = self.seed_catalog(products)
+        self.seed_sales(sales)
+        self.seed_orders(max(50, sales // 5))
+        self.seed_expenses(self.days * 3)
+
+        # Bulk inserts send no signals: rebuild every derived structure
+        self.stdout.write("rebuilding derived data...")
+        rollups.rebuild()
+        valuation.reconcile()
+        lowstock.rebuild()
+        search_index.invalidate()
+        for scope in report_cache.SCOPES:
+            report_cache.bump(scope)
+        self.stdout.write(self.style.SUCCESS("done"))
+
+    # --- helpers -----------------------------------------------------
+    def moment(self):
+        """Random aware datetime in the history window, during opening hours."""
+        day = self.today - timedelta(days=self.rng.randrange(self.days))
+        clock = time(hour=self.rng.randint(8, 20), minute=self.rng.randrange(60), second=self.rng.randrange(60))
+        return timezone.make_aware(datetime.combine(day, clock))
+
+    def insert(self, model, objs):
+        created = []
+        for i in range(0, len(objs), CHUNK):
+            with transaction.atomic():
+                created.extend(model.objects.bulk_create(objs[i:i + CHUNK]))
+        if created and created[0].pk is None:
+            raise CommandError("This database backend does not return ids from bulk inserts (use PostgreSQL or SQLite).")
+        return created
+
+    # --- data --------------------------------------------------------
+    def seed_users(self):
+        User = get_user_model()
+        users = []
+        for i in range(1, 6):
+            user, created = User.objects.get_or_create(
+                username=f"seed_cashier_{i}",
+                defaults={'role': 'cashier'} if hasattr(User, 'role') else {},
+            )
+            if created:
+                user.set_unusable_password()
+                user.save()
+            users.append(user)
+        return users
+
+    def seed_customers(self, count):
+        objs = [
+            _fit(Customer, name=f"Customer {i:06d}", phone=f"+2557{i:08d}", email=f"customer{i}@example.com")
+            for i in range(count)
+        ]
+        return self.insert(Customer, objs)
+
+    def seed_catalog(self, count):
+        categories = [Category.objects.get_or_create(name=name)[0] for name in CATEGORIES]
+        objs = []
+        for i in range(count):
+            name = f"{self.rng.choice(NAME_PARTS)}{self.rng.choice(SUFFIXES)} {self.rng.choice(FORMS)} #{i}"
+            objs.append(_fit(
+                Product, name=name, category=self.rng.choice(categories),
+                threshold=self.rng.choice([5, 10, 20, 50]),
+            ))
+        products = self.insert(Product, objs)
+
+        batches = []
+        for product in products:
+            cost = _money(self.rng.uniform(200, 50000))
+            for n in range(self.rng.randint(2, 5)):
+                # Some batches expired already, some expire soon
+                expiry = self.today + timedelta(days=self.rng.randint(-60, 900))
+                batches.append(_fit(
+                    ProductBatch,
+                    product=product,
+                    batch_code=f"B{product.pk:06d}-{n}",
+                    expiry_date=expiry,
+                    quantity=self.rng.randint(0, 500),
+                    buying_price=cost,
+                    selling_price=_money(cost * Decimal("1.35")),
+                    wholesale_price=_money(cost * Decimal("1.15")),
+                    recorded_by=self.rng.choice(self.users),
+                ))
+        batches = self.insert(ProductBatch, batches)
+
+        with _backdating(*_date_fields((StockEntry, 'date'))):
+            self.insert(StockEntry, [
+                _fit(StockEntry, product_id=b.product_id, batch=b, entry_type='added',
+                     quantity=b.quantity, recorded_by=b.recorded_by, date=self.moment())
+                for b in batches if b.quantity
+            ])
+        return batches
+
+    def seed_sales(self, count):
+        self.confirmed = []
+        done = 0
+        while done < count:
+            n = min(SALES_PER_ROUND, count - done)
+            self.seed_sales_round(n)
+            done += n
+            self.stdout.write(f"sales: {done}/{count}", ending="\r")
+        self.stdout.write("")
+
+        # Batch quantities were moved in memory (sold, restocked, returned): write them once
+        for i in range(0, len(self.batches), CHUNK):
+            with transaction.atomic():
+                ProductBatch.objects.bulk_update(self.batches[i:i + CHUNK], ['quantity'])
+
+    def take(self, batch, quantity, when, restocks):
+        """Sell ``quantity`` from ``batch``, restocking it first (a logged purchase) if it runs short."""
+        if batch.quantity < quantity:
+            added = quantity - batch.quantity + self.rng.randint(100, 500)
+            batch.quantity += added
+            restocks.append(_fit(StockEntry, product_id=batch.product_id, batch=batch, entry_type='added',
+                                 quantity=added, recorded_by=batch.recorded_by, date=when))
+        batch.quantity -= quantity
+
+    def seed_sales_round(self, count):
+        sales, lines, restocks = [], [], []
+        for _ in range(count):
+            wholesale = self.rng.random() < 0.1
+            date = self.moment()
+            items = []
+            for batch in self.rng.sample(self.batches, self.rng.randint(3, 20) if wholesale else self.rng.randint(1, 4)):
+                price = batch.wholesale_price if wholesale else batch.selling_price
+                quantity = self.rng.randint(5, 100) if wholesale else self.rng.randint(1, 5)
+                self.take(batch, quantity, date, restocks)
+                items.append((batch, quantity, price))
+            total = sum(q * p for _, q, p in items)
+
+            is_loan = self.rng.random() < 0.08
+            refunded = not is_loan and self.rng.random() < 0.02
+            paid = total
+            payment_status = 'paid'
+            if is_loan:
+                # Unpaid, partially paid or settled loans
+                paid = _money(total * Decimal(self.rng.choice([0, 0.25, 0.5, 0.75, 1])))
+                payment_status = 'paid' if paid >= total else ('partial' if paid else 'unpaid')
+
+            sales.append(_fit(
+                Sale,
+                user=self.rng.choice(self.users),
+                customer=self.rng.choice(self.customers) if wholesale or is_loan or self.rng.random() < 0.3 else None,
+                date=date,
+                sale_type='wholesale' if wholesale else 'retail',
+                payment_method=self.rng.choice(['cash', 'cash', 'mobile', 'card']),
+                total_amount=total,
+                final_amount=total,
+                paid_amount=paid,
+                payment_status='refunded' if refunded else payment_status,
+                status='refunded' if refunded else 'confirmed',
+                is_loan=is_loan,
+                refund_total=paid if refunded else 0,
+            ))
+            lines.append(items)
+
+        with _backdating(*_date_fields((Sale, 'date'))):
+            sales = self.insert(Sale, sales)
+
+        sale_items, payments, refunds = [], [], []
+        for sale, items in zip(sales, lines):
+            for batch, quantity, price in items:
+                sale_items.append(_fit(SaleItem, sale=sale, product_id=batch.product_id, batch=batch,
+                                       quantity=quantity, price_per_unit=price))
+            if sale.paid_amount:
+                # Loans are paid in instalments
+                parts = self.rng.randint(1, 3) if sale.is_loan else 1
+                for n in range(parts):
+                    amount = sale.paid_amount / parts
+                    payments.append(_fit(Payment, sale=sale, amount_paid=_money(amount), cashier=sale.user,
+                                         payment_method=sale.payment_method, payment_date=sale.date + timedelta(days=n * 7)))
+            if sale.status == 'refunded':
+                payments.append(_fit(Payment, sale=sale, amount_paid=-sale.paid_amount, cashier=sale.user,
+                                     payment_method="refund", payment_date=sale.date + timedelta(days=1)))
+                for batch, quantity, _ in items:
+                    refunds.append(_fit(Refund, sale=sale, product_id=batch.product_id, batch=batch, quantity=quantity,
+                                        refund_amount=0, refunded_by=sale.user, refund_date=sale.date + timedelta(days=1)))
+
+        self.insert(SaleItem, sale_items)
+        with _backdating(*_date_fields((Payment, 'payment_date'), (Refund, 'refund_date'))):
+            self.insert(Payment, payments)
+            self.insert(Refund, refunds)
+
+        for r in refunds:
+            r.batch.quantity += r.quantity
+
+        with _backdating(*_date_fields((StockEntry, 'date'))):
+            self.insert(StockEntry, restocks + [
+                _fit(StockEntry, product_id=r.product_id, batch=r.batch, entry_type='returned',
+                     quantity=r.quantity, recorded_by=r.refunded_by, date=r.refund_date)
+                for r in refunds
+            ])
+
+        room = ORDER_SALE_POOL - len(self.confirmed)
+        if room > 0:
+            self.confirmed.extend([s for s in sales if s.status == 'confirmed'][:room])
+
+    def seed_orders(self, count):
+        # Order.sale is the reverse side of a one-to-one on Sale: each sale
+        # backs at most one order, and the link is stored on the sale
+        link = Order._meta.get_field('sale').field
+        unlinked = list(self.confirmed)
+        self.rng.shuffle(unlinked)
+        orders, order_sales = [], []
+        for _ in range(count):
+            state = self.rng.choices(['pending', 'rejected', 'updated', 'confirmed'], weights=[2, 1, 1, 6])[0]
+            sale = unlinked.pop() if state == 'confirmed' and unlinked else None
+            orders.append(_fit(
+                Order,
+                user=self.rng.choice(self.users),
+                customer=sale.customer if sale else self.rng.choice(self.customers),
+                order_type=sale.sale_type if sale else self.rng.choice(['retail', 'wholesale']),
+                status=state,
+                notes="seeded",
+                created_at=sale.date if sale else self.moment(),
+            ))
+            order_sales.append(sale)
+        with _backdating(*_date_fields((Order, 'created_at'))):
+            orders = self.insert(Order, orders)
+
+        linked = []
+        for order, sale in zip(orders, order_sales):
+            if sale is not None:
+                setattr(sale, link.attname, order.pk)
+                linked.append(sale)
+        for i in range(0, len(linked), CHUNK):
+            with transaction.atomic():
+                Sale.objects.bulk_update(linked[i:i + CHUNK], [link.name])
+
+        # Order lines: whatever model backs Order.items
+        try:
+            OrderItem = Order._meta.get_field('items').related_model
+        except Exception:
+            self.stdout.write(self.style.WARNING("Order has no 'items' relation; orders seeded without lines."))
+            return
+        items = []
+        for order in orders:
+            for batch in self.rng.sample(self.batches, self.rng.randint(1, 5)):
+                items.append(_fit(OrderItem, order=order, product_id=batch.product_id, batch=batch,
+                                  quantity=self.rng.randint(1, 10), price=batch.selling_price))
+        self.insert(OrderItem, items)
+
+    def seed_expenses(self, count):
+        with _backdating(*_date_fields((Expense, 'date'))):
+            self.insert(Expense, [
+                _fit(Expense, amount=_money(self.rng.uniform(5000, 2000000)),
+                     category=self.rng.choice(EXPENSE_CATEGORIES), description="seeded expense",
+                     date=self.moment(), recorded_by=self.rng.choice(self.users))
+                for _ in range(count)
+            ])
@@ -0,0 +1,202 @@
+"""Per-view request metrics without any external service.
+
+``RequestMetricsMiddleware`` records, for every resolved view and action
+(``OrderViewSet.confirm``, ``ReportSummaryAPIView``, ...): request count by
+status, a latency histogram, the number of SQL queries and the time spent
+in them. Queries are counted with ``connection.execute_wrapper``, so it
+works with ``DEBUG = False``. Requests over the query budget are logged as
+warnings. The numbers live in this process and are rendered in Prometheus
+text format by ``render()`` (served at ``/api/metrics``).
+
+Settings:
+
+* ``REQUEST_METRICS_ENABLED`` (default False) - when off the middleware
+  removes itself at startup (``MiddlewareNotUsed``) and costs nothing.
+* ``REQUEST_METRICS_QUERY_BUDGET`` (default 50) - queries per request
+  before a warning is logged; 0 disables the warning.
+* ``REQUEST_METRICS_TOKEN`` - optional token scrapers send in the
+  ``X-Metrics-Token`` header; without it the endpoint is admin-only.
+
+Queries run in worker threads (``concurrency.fan_out``) are not counted,
+and streamed responses are timed up to the first byte.
+"""
+import hmac
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUERY_BUDGET = 50
+
+
+class _ViewStats:
+    __slots__ = ('requests', 'buckets', 'latency_sum', 'queries', 'sql_seconds', 'over_budget')
+
+    def __init__(self):
+        self.requests = {}                      # status code class -> count
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.over_budget = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, method, status, seconds, queries, sql_seconds, over_budget=False):
+        status_class = f"{status // 100}xx"
+        with self._lock:
+            stats = self._views.get((view, method))
+            if stats is None:
+                stats = self._views[(view, method)] = _ViewStats()
+            stats.requests[status_class] = stats.requests.get(status_class, 0) + 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            stats.latency_sum += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            if over_budget:
+                stats.over_budget += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                key: (dict(s.requests), list(s.buckets), s.latency_sum, s.queries, s.sql_seconds, s.over_budget)
+                for key, s in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """All recorded metrics in the Prometheus text exposition format."""
+    snapshot = sorted(registry.snapshot().items())
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    family("http_requests_total", "counter", "Requests by view, method and status class.")
+    for (view, method), (requests, *_rest) in snapshot:
+        for status_class, count in sorted(requests.items()):
+            lines.append(
+                f'http_requests_total{{view="{_label(view)}",method="{method}",status="{status_class}"}} {count}'
+            )
+
+    family("http_request_duration_seconds", "histogram", "Request latency by view and method.")
+    for (view, method), (requests, buckets, latency_sum, *_rest) in snapshot:
+        labels = f'view="{_label(view)}",method="{method}"'
+        for bound, count in zip(LATENCY_BUCKETS, buckets):
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        total = sum(requests.values())
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {latency_sum:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {total}')
+
+    family("db_queries_total", "counter", "SQL queries executed by view and method.")
+    for (view, method), (_, _, _, queries, _, _) in snapshot:
+        lines.append(f'db_queries_total{{view="{_label(view)}",method="{method}"}} {queries}')
+
+    family("db_query_duration_seconds_total", "counter", "Time spent in SQL by view and method.")
+    for (view, method), (_, _, _, _, sql_seconds, _) in snapshot:
+        lines.append(f'db_query_duration_seconds_total{{view="{_label(view)}",method="{method}"}} {sql_seconds:.6f}')
+
+    family("http_requests_over_query_budget_total", "counter", "Requests that ran more queries than the budget.")
+    for (view, method), (_, _, _, _, _, over_budget) in snapshot:
+        lines.append(
+            f'http_requests_over_query_budget_total{{view="{_label(view)}",method="{method}"}} {over_budget}'
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def scrape_token_ok(request):
+    token = getattr(settings, 'REQUEST_METRICS_TOKEN', None)
+    sent = request.META.get('HTTP_X_METRICS_TOKEN')
+    return bool(token and sent) and hmac.compare_digest(str(token), sent)
+
+
+def view_name(request, view_func):
+    """``ViewSet.action`` for viewsets, the class name for APIViews, else the function name."""
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is None:
+        return getattr(view_func, '__name__', repr(view_func))
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower())
+        if action:
+            return f"{cls.__name__}.{action}"
+    return cls.__name__
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'REQUEST_METRICS_QUERY_BUDGET', DEFAULT_QUERY_BUDGET)
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        # Unresolved URLs (404 from the resolver) have no view to file them under
+        view = getattr(request, '_metrics_view', None)
+        if view is not None:
+            over_budget = bool(self.query_budget) and counter.count > self.query_budget
+            if over_budget:
+                logger.warning(
+                    "%s %s ran %d SQL queries (budget %d, %.1f ms in SQL, %.1f ms total)",
+                    request.method, view, counter.count, self.query_budget,
+                    counter.seconds * 1000, elapsed * 1000,
+                )
+            registry.observe(
+                view, request.method, response.status_code,
+                elapsed, counter.count, counter.seconds, over_budget,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_name(request, view_func)
+        return None
@@ -0,0 +1,155 @@
+"""Report periods shared by every report view.
+
+``resolve()`` turns ``period``/``start``/``end`` into a ``Period``: inclusive
+first/last local days plus the half-open, timezone-aware datetime range
+``[start, end)`` covering them. Filtering with ``period.q('date')`` compares
+the raw column against two constants (``date >= x AND date < y``), so the
+index on ``date`` is usable, unlike ``date__date__gte`` which casts every
+row first.
+
+``series()`` groups a queryset into the period's day/week/month/year
+buckets on the database side and returns every bucket of the period, empty
+ones included, oldest first.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+BUCKETS = {'daily': 'day', 'weekly': 'week', 'monthly': 'month', 'yearly': 'year'}
+TRUNC = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'year': TruncYear}
+
+# How far back the trailing (chart) windows reach, per period
+TRAILING = {
+    'daily': timedelta(days=30),
+    'weekly': timedelta(weeks=12),
+    'monthly': timedelta(days=365),
+    'yearly': timedelta(days=365 * 5),
+}
+
+
+class PeriodError(ValueError):
+    pass
+
+
+def local_midnight(day):
+    """Start of ``day`` in the current time zone, as an aware datetime."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def _next_bucket(day, bucket):
+    if bucket == 'week':
+        return day + timedelta(weeks=1)
+    if bucket == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if bucket == 'year':
+        return day.replace(year=day.year + 1, month=1, day=1)
+    return day + timedelta(days=1)
+
+
+class Period:
+    def __init__(self, name, first_day, last_day, bucket='day'):
+        self.name = name
+        self.first_day = first_day
+        self.last_day = last_day
+        self.bucket = bucket
+        self.start = local_midnight(first_day)
+        self.end = local_midnight(last_day + timedelta(days=1))
+
+    def __repr__(self):
+        return f"<Period {self.name} {self.first_day}..{self.last_day} by {self.bucket}>"
+
+    def q(self, field='date'):
+        """``field`` inside the period, as a half-open range on the raw column."""
+        return Q(**{f"{field}__gte": self.start, f"{field}__lt": self.end})
+
+    def buckets(self):
+        """Start day of every bucket in the period, oldest first."""
+        result = []
+        day = bucket_start(self.first_day, self.bucket)
+        while day <= self.last_day:
+            result.append(day)
+            day = _next_bucket(day, self.bucket)
+        return result
+
+
+def between(first_day, last_day, bucket='day'):
+    return Period('custom', first_day, last_day, bucket)
+
+
+def resolve(period='daily', start=None, end=None, *, trailing=False, allow_custom=False, today=None):
+    """Build the ``Period`` for report query parameters.
+
+    Presets run from the start of the current day/week/month/year up to
+    today. With ``trailing`` they reach back a fixed window instead (30
+    days, 12 weeks, 1 year, 5 years), aligned to whole buckets, for charts.
+    ``custom`` takes ``start``/``end`` (YYYY-MM-DD, both inclusive).
+    """
+    today = today or timezone.localdate()
+    period = (period or 'daily').lower()
+
+    if period == 'custom' and allow_custom:
+        try:
+            first_day = parse_date(start or '')
+            last_day = parse_date(end or '')
+        except ValueError:
+            first_day = last_day = None
+        if not first_day or not last_day:
+            raise PeriodError("Custom periods need start and end dates (YYYY-MM-DD).")
+        if first_day > last_day:
+            raise PeriodError("start must not be after end.")
+        return Period(period, first_day, last_day, 'day')
+
+    if period not in BUCKETS:
+        choices = ", ".join(list(BUCKETS) + (['custom'] if allow_custom else []))
+        raise PeriodError(f"Invalid period. Choose from {choices}.")
+
+    bucket = BUCKETS[period]
+    first_day = today - TRAILING[period] if trailing else today
+    return Period(period, bucket_start(first_day, bucket), today, bucket)
+
+
+def from_request(request, default='daily', **kwargs):
+    params = getattr(request, 'query_params', request.GET)
+    return resolve(params.get('period', default), params.get('start'), params.get('end'), **kwargs)
+
+
+def _bucket_day(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def series(queryset, field, period, **aggregates):
+    """``{bucket start day: {name: value}}`` for every bucket of ``period``.
+
+    One grouped query (``GROUP BY trunc(field)``) over the period's range;
+    buckets without rows get ``0`` for every aggregate.
+    """
+    rows = (
+        queryset
+        .filter(period.q(field))
+        .annotate(bucket=TRUNC[period.bucket](field))
+        .values('bucket')
+        .annotate(**aggregates)
+        .order_by('bucket')
+    )
+    result = {day: {name: 0 for name in aggregates} for day in period.buckets()}
+    for row in rows:
+        entry = result.setdefault(bucket_start(_bucket_day(row['bucket']), period.bucket), {})
+        for name in aggregates:
+            entry[name] = row[name] or 0
+    return result
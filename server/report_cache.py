@@ -0,0 +1,185 @@
+"""Response cache and conditional GET support for the report endpoints.
+
+Each cached body is keyed by the view, the caller's role, the normalized
+query string, today's date and the version counters of the data it was
+built from. Writes to the underlying models bump those counters (after
+commit), so a stale entry can never be served: it is simply never looked up
+again and ages out. Counters and entries live in the derived-data cache
+(see ``shared_cache``) and work on any backend. On a shared one (Redis,
+Memcached, database, file) a bump in one worker reaches all of them; an
+increment lost to a non-atomic backend still leaves the counter changed.
+With local memory each worker sees its own bumps and other workers' writes
+once its entries age out (REPORT_TIMEOUT). A counter that is evicted
+restarts from the clock, never from a value an old entry was keyed with.
+
+ETags add the database's own high-water mark to that stamp (the latest id
+of every model in the scopes, an index-only lookup each), letting polling
+clients get a ``304 Not Modified`` without the view running at all. An
+ETag therefore changes with every insert even if a version counter was
+lost; updates and deletes are seen through the counters.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Sale, SaleItem, Payment, Refund, Expense, Product, ProductBatch, StockEntry
+from .shared_cache import cache, seed
+
+
+VERSION_KEY = "data-version:{}"
+REPORT_KEY = "report:{view}:{digest}"
+REPORT_TIMEOUT = 10 * 60
+
+# Data scopes and the models whose writes invalidate them
+SCOPES = {
+    'sales': (Sale, SaleItem, Payment, Refund),
+    'expenses': (Expense,),
+    # Product is here for the low-stock threshold and product names
+    'stock': (ProductBatch, StockEntry, Product),
+    # last_login is saved on every login
+    'users': (get_user_model(),),
+}
+
+
+def data_version(scope):
+    """Current version counter of ``scope`` (created on first use)."""
+    key = VERSION_KEY.format(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, seed(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def data_versions(*scopes):
+    keys = {VERSION_KEY.format(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    return tuple(
+        found[key] if key in found else data_version(scope)
+        for key, scope in keys.items()
+    )
+
+
+def bump(scope):
+    """Invalidate everything built from ``scope`` once the transaction commits."""
+    def _bump():
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, seed(), timeout=None)
+    transaction.on_commit(_bump)
+
+
+def _normalized_params(request):
+    return sorted(
+        (key, tuple(sorted(values)))
+        for key, values in request.query_params.lists()
+    )
+
+
+def data_marks(*scopes):
+    """Latest id of every model in ``scopes``, read from the database.
+
+    One ``MAX(pk)`` per model and nothing else in the query, so the planner
+    answers each from the end of the primary key index. Inserts move these
+    on every worker at once; updates and deletes are caught by the version
+    counters.
+    """
+    models = list(dict.fromkeys(model for scope in scopes for model in SCOPES[scope]))
+    return tuple(
+        model.objects.aggregate(mark=Max('pk'))['mark']
+        for model in models
+    )
+
+
+def _stamp(view_name, request, scopes, marks=(), versions=None):
+    parts = (
+        view_name,
+        getattr(request.user, 'role', None),
+        _normalized_params(request),
+        timezone.localdate().isoformat(),
+        versions if versions is not None else data_versions(*scopes),
+        marks,
+    )
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def report_key(view_name, request, scopes):
+    return REPORT_KEY.format(view=view_name, digest=_stamp(view_name, request, scopes))
+
+
+def _etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or etag[2:] in candidates
+
+
+def cached_report(*scopes, timeout=REPORT_TIMEOUT):
+    """Cache a report view's ``get`` until any of ``scopes`` changes.
+
+    Only successful DRF ``Response`` bodies are stored; streamed exports and
+    error responses always go through to the view.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = report_key(type(self).__name__, request, scopes)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = method(self, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                cache.set(key, response.data, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_report(*scopes):
+    """Answer ``If-None-Match`` with 304 while none of ``scopes`` changed.
+
+    The ETag is derived from the data version counters and the database
+    marks (``data_marks``), not from the body, so a match skips the view
+    (its queries and serialization) entirely.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            versions = data_versions(*scopes)
+            etag = f'W/"{_stamp(type(self).__name__, request, scopes, data_marks(*scopes), versions)}"'
+            # Without counters (DummyCache) updates can't be seen: always run the view
+            if None not in versions and _etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = method(self, request, *args, **kwargs)
+                if not (isinstance(response, Response) and response.status_code == 200):
+                    return response
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def _connect():
+    for scope, models in SCOPES.items():
+        def receiver(sender, scope=scope, **kwargs):
+            bump(scope)
+        for model in models:
+            uid = f"report-cache:{scope}:{model.__name__}"
+            post_save.connect(receiver, sender=model, weak=False, dispatch_uid=uid + ":save")
+            post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=uid + ":delete")
+
+
+_connect()
@@ -0,0 +1,310 @@
+"""Per-day and per-month sales totals kept in the cache so reports don't rescan Sale.
+
+Every day and every calendar month gets one entry holding the paid totals
+(split by sale type), sale count, refunds and loan paid/unpaid. Ranges are
+read as whole months plus the loose days at either end, so even an
+all-time total is a few dozen lookups; missing entries are rebuilt with one
+grouped query per granularity.
+
+Entries are keyed by a generation counter per day/month. Writes to Sale,
+Payment and Refund bump the counters of the affected day and month once
+the transaction commits, instead of deleting entries: a reader that built
+an entry from data read before that commit stores it under the old
+generation, where nobody looks it up again. The entries live in the shared
+derived-data cache (see ``shared_cache``), so every worker and the
+``rebuild_sales_rollup`` command see the same ones.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Count, Q, F, Min, ExpressionWrapper, DecimalField
+from django.db.models.functions import TruncDate, TruncMonth
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Sale, Payment, Refund
+from .periods import between, bucket_start, local_midnight
+from .shared_cache import cache, seed
+
+
+ENTRY_KEY = "sales-rollup:{kind}:{start}:{generation}"
+GENERATION_KEY = "sales-rollup:generation:{kind}:{start}"
+
+# Entries covering today are still filling up and get a short lifetime to
+# bound any drift from writes that bypass the ORM signals. Closed days and
+# months only change through the signals below.
+TODAY_TIMEOUT = 5 * 60
+PAST_TIMEOUT = 30 * 24 * 60 * 60
+
+FIELDS = (
+    "total", "retail", "wholesale", "count",
+    "refunds", "refund_count", "loan_paid", "loan_unpaid",
+)
+
+
+def _empty_day():
+    return {
+        "total": Decimal("0.00"),
+        "retail": Decimal("0.00"),
+        "wholesale": Decimal("0.00"),
+        "count": 0,
+        "refunds": Decimal("0.00"),
+        "refund_count": 0,
+        "loan_paid": Decimal("0.00"),
+        "loan_unpaid": Decimal("0.00"),
+    }
+
+
+def sale_day(value):
+    """Local calendar day a Sale.date belongs to (matches ``date__date``)."""
+    if timezone.is_aware(value):
+        return timezone.localdate(value)
+    return value.date()
+
+
+def _days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def _month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def _pieces(start, end):
+    """Split [start, end] into the whole months inside it and the remaining days."""
+    days, months = [], []
+    day = start
+    while day <= end:
+        if day.day == 1 and _month_end(day) <= end:
+            months.append(day)
+            day = _month_end(day) + timedelta(days=1)
+        else:
+            days.append(day)
+            day += timedelta(days=1)
+    return days, months
+
+
+def _grouped(start, end, trunc):
+    remaining_expr = ExpressionWrapper(
+        F('total_amount') - F('paid_amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    valid_q = ~Q(status='refunded')
+    refunded_q = Q(status='refunded')
+    loan_q = valid_q & Q(is_loan=True)
+
+    return (
+        Sale.objects
+        .filter(date__gte=local_midnight(start), date__lt=local_midnight(end + timedelta(days=1)))
+        .annotate(day=trunc('date'))
+        .values('day')
+        .annotate(
+            total=Sum('paid_amount', filter=valid_q),
+            retail=Sum('paid_amount', filter=valid_q & Q(sale_type='retail')),
+            wholesale=Sum('paid_amount', filter=valid_q & Q(sale_type='wholesale')),
+            count=Count('id', filter=valid_q),
+            refunds=Sum('total_amount', filter=refunded_q),
+            refund_count=Count('id', filter=refunded_q),
+            loan_paid=Sum('paid_amount', filter=loan_q & Q(paid_amount__gt=0)),
+            loan_unpaid=Sum(remaining_expr, filter=loan_q & Q(total_amount__gt=F('paid_amount'))),
+        )
+        .order_by('day')
+    )
+
+
+def grouped_days(start, end):
+    """Sale totals for [start, end] grouped by day on the database side."""
+    return _grouped(start, end, TruncDate)
+
+
+def _collect(rows, starts):
+    result = {start: _empty_day() for start in starts}
+    for row in rows:
+        day = row['day']
+        if isinstance(day, datetime):
+            day = sale_day(day).replace(day=1)
+        entry = result.setdefault(day, _empty_day())
+        for field in FIELDS:
+            if row[field] is not None:
+                entry[field] = row[field]
+    return result
+
+
+def compute_days(start, end):
+    """Aggregate Sale for every day in [start, end] with one grouped query."""
+    return _collect(grouped_days(start, end), _days(start, end))
+
+
+def compute_months(first_months_day, last_months_day):
+    """Aggregate Sale for every month from ``first_months_day`` to ``last_months_day`` (both 1st of the month)."""
+    months = []
+    day = first_months_day
+    while day <= last_months_day:
+        months.append(day)
+        day = _month_end(day) + timedelta(days=1)
+    return _collect(_grouped(first_months_day, _month_end(last_months_day), TruncMonth), months)
+
+
+_COMPUTE = {
+    'day': lambda starts: compute_days(starts[0], starts[-1]),
+    'month': lambda starts: compute_months(starts[0], starts[-1]),
+}
+_LAST_DAY = {
+    'day': lambda start: start,
+    'month': _month_end,
+}
+
+
+def _generation_key(kind, start):
+    return GENERATION_KEY.format(kind=kind, start=start.isoformat())
+
+
+def _generations(kind, starts):
+    keys = {_generation_key(kind, start): start for start in starts}
+    found = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, seed(), timeout=None)
+        found.update(cache.get_many(missing))
+    return {start: found.get(key) for key, start in keys.items()}
+
+
+def _store(kind, data, generations):
+    today = timezone.localdate()
+    past, recent = {}, {}
+    for start, entry in data.items():
+        key = ENTRY_KEY.format(kind=kind, start=start.isoformat(), generation=generations[start])
+        (past if _LAST_DAY[kind](start) < today else recent)[key] = entry
+    if past:
+        cache.set_many(past, timeout=PAST_TIMEOUT)
+    if recent:
+        cache.set_many(recent, timeout=TODAY_TIMEOUT)
+
+
+def _load(kind, starts):
+    """Entries of ``kind`` ('day' or 'month') for ``starts``, computing the missing ones."""
+    if not starts:
+        return {}
+    # Generations are read before anything is computed, so an entry built
+    # from data that changes meanwhile lands under a generation that is
+    # already out of date.
+    generations = _generations(kind, starts)
+    keys = {
+        ENTRY_KEY.format(kind=kind, start=start.isoformat(), generation=generations[start]): start
+        for start in starts
+    }
+    cached = cache.get_many(list(keys))
+
+    result = {keys[key]: value for key, value in cached.items()}
+    missing = [start for start in starts if start not in result]
+    if missing:
+        fresh = _COMPUTE[kind](missing)
+        fresh = {start: fresh[start] for start in missing}
+        _store(kind, fresh, generations)
+        result.update(fresh)
+    return result
+
+
+def daily_rollup(start, end):
+    """Return ``{day: totals}`` for every day in [start, end], oldest first."""
+    days = list(_days(start, end))
+    result = _load('day', days)
+    return {day: result[day] for day in days}
+
+
+def _add(target, entry):
+    for field in FIELDS:
+        target[field] += entry[field]
+
+
+def rollup_totals(start, end):
+    """Sum of the rollup over [start, end]."""
+    days, months = _pieces(start, end)
+    totals = _empty_day()
+    for entry in list(_load('day', days).values()) + list(_load('month', months).values()):
+        _add(totals, entry)
+    return totals
+
+
+def rollup_series(start, end, bucket='day'):
+    """Group the rollup into day/week/month/year buckets.
+
+    Every bucket of [start, end] is present, oldest first; quiet ones are zero.
+    """
+    series = {day: _empty_day() for day in between(start, end, bucket).buckets()}
+    if bucket in ('month', 'year'):
+        days, months = _pieces(start, end)
+        entries = {**_load('day', days), **_load('month', months)}
+    else:
+        entries = daily_rollup(start, end)
+    for day, entry in entries.items():
+        _add(series[bucket_start(day, bucket)], entry)
+    return series
+
+
+def first_sale_day():
+    first = Sale.objects.aggregate(first=Min('date'))['first']
+    return sale_day(first) if first else None
+
+
+def _bump(kind, start):
+    key = _generation_key(kind, start)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, seed(), timeout=None)
+
+
+def invalidate_days(*days):
+    for day in set(days):
+        _bump('day', day)
+        _bump('month', day.replace(day=1))
+
+
+def touch_sale(sale):
+    """Move ``sale``'s day and month to a new generation once the current transaction commits."""
+    if sale is None or not sale.date:
+        return
+    day = sale_day(sale.date)
+    transaction.on_commit(lambda: invalidate_days(day))
+
+
+def rebuild(start=None, end=None):
+    """Recompute and store the rollup for [start, end] (defaults to all history)."""
+    start = start or first_sale_day()
+    end = end or timezone.localdate()
+    if start is None:
+        return 0
+    days = list(_days(start, end))
+    generations = _generations('day', days)
+    _store('day', compute_days(start, end), generations)
+
+    _, months = _pieces(start, end)
+    if months:
+        generations = _generations('month', months)
+        _store('month', compute_months(months[0], months[-1]), generations)
+    return len(days)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def _sale_changed(sender, instance, **kwargs):
+    touch_sale(instance)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Refund)
+@receiver(post_delete, sender=Refund)
+def _sale_child_changed(sender, instance, **kwargs):
+    try:
+        sale = instance.sale
+    except Sale.DoesNotExist:
+        return
+    touch_sale(sale)
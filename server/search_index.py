@@ -0,0 +1,370 @@
+"""In-process typeahead index over product names and batch codes.
+
+Names and batch codes are broken into 1-2 character prefixes (for the first
+keystrokes) and trigrams (for everything longer), each mapping to product
+ids, so a lookup is a few set intersections instead of an ``icontains``
+scan.
+
+Product/batch signals update the local index after commit and append the
+product id to a change log in the shared derived-data cache (see
+``shared_cache``), numbered by the "catalog" version. Other worker
+processes notice the new version on their next lookup and re-read just the
+logged products. Only when the log can't be used do they rebuild, in a
+background thread, while lookups keep using the index they have.
+"""
+import logging
+import threading
+
+from django.db import connections, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product, ProductBatch
+from .shared_cache import cache, seed
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "data-version:catalog"
+CHANGE_KEY = "catalog-change:{}"
+CHANGE_TIMEOUT = 24 * 60 * 60
+# Further behind than this, a rebuild is cheaper than replaying the log
+CATCH_UP_LIMIT = 1000
+REBUILD = "*"
+
+
+def _normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _prefixes(text):
+    keys = set()
+    for word in text.split():
+        keys.add(word[:1])
+        keys.add(word[:2])
+    return keys
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self.version = None
+        self.built = False
+        self._reset()
+
+    def _reset(self):
+        self.names = {}        # product id -> normalized name
+        self.codes = {}        # product id -> set of normalized batch codes
+        self.by_code = {}      # normalized batch code -> set of product ids
+        self.prefixes = {}     # 1-2 char word prefix -> set of product ids
+        self.trigrams = {}     # trigram -> set of product ids
+
+    # --- maintenance -------------------------------------------------
+    def _texts(self, product_id):
+        texts = set(self.codes.get(product_id, ()))
+        if product_id in self.names:
+            texts.add(self.names[product_id])
+        return texts
+
+    def _keys(self, texts):
+        prefixes, grams = set(), set()
+        for text in texts:
+            prefixes |= _prefixes(text)
+            for word in text.split():
+                grams |= _trigrams(word)
+        return prefixes, grams
+
+    def _reindex(self, product_id, before):
+        """Move ``product_id`` from the keys of ``before`` to the keys of its current texts."""
+        old_prefixes, old_grams = self._keys(before)
+        new_prefixes, new_grams = self._keys(self._texts(product_id))
+        for table, old, new in ((self.prefixes, old_prefixes, new_prefixes),
+                                (self.trigrams, old_grams, new_grams)):
+            for key in old - new:
+                ids = table.get(key)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del table[key]
+            for key in new - old:
+                table.setdefault(key, set()).add(product_id)
+
+    def add_product(self, product_id, name):
+        with self._lock:
+            before = self._texts(product_id)
+            self.names[product_id] = _normalize(name)
+            self._reindex(product_id, before)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            before = self._texts(product_id)
+            self.names.pop(product_id, None)
+            for code in self.codes.pop(product_id, ()):
+                ids = self.by_code.get(code)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del self.by_code[code]
+            self._reindex(product_id, before)
+
+    def add_code(self, product_id, code):
+        code = _normalize(code)
+        if not code:
+            return
+        with self._lock:
+            before = self._texts(product_id)
+            self.codes.setdefault(product_id, set()).add(code)
+            self.by_code.setdefault(code, set()).add(product_id)
+            self._reindex(product_id, before)
+
+    def remove_code(self, product_id, code):
+        code = _normalize(code)
+        with self._lock:
+            before = self._texts(product_id)
+            self.codes.get(product_id, set()).discard(code)
+            ids = self.by_code.get(code)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self.by_code[code]
+            self._reindex(product_id, before)
+
+    def replace_products(self, product_ids, names, codes):
+        """Re-index ``product_ids`` from fresh ``{id: name}`` / ``{id: [codes]}`` (absent = deleted)."""
+        with self._lock:
+            for product_id in product_ids:
+                self.remove_product(product_id)
+                if product_id in names:
+                    self.add_product(product_id, names[product_id])
+                    for code in codes.get(product_id, ()):
+                        self.add_code(product_id, code)
+
+    def build(self):
+        """Load the whole catalog into a fresh index and swap it in; lookups use the old one meanwhile."""
+        version = current_version()
+        fresh = ProductSearchIndex()
+        for product_id, name in Product.objects.values_list('id', 'name').iterator():
+            fresh.add_product(product_id, name)
+        for product_id, code in ProductBatch.objects.values_list('product_id', 'batch_code').iterator():
+            fresh.add_code(product_id, code)
+        with self._lock:
+            self.names, self.codes, self.by_code = fresh.names, fresh.codes, fresh.by_code
+            self.prefixes, self.trigrams = fresh.prefixes, fresh.trigrams
+            self.version = version
+            self.built = True
+
+    def _catch_up(self, current):
+        """Apply the changes logged since our version; False if only a rebuild can help."""
+        if self.version is None or not 0 < current - self.version <= CATCH_UP_LIMIT:
+            return False
+        keys = [CHANGE_KEY.format(seq) for seq in range(self.version + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys) or any(change == REBUILD for change in changes.values()):
+            return False
+
+        product_ids = {product_id for change in changes.values() for product_id in change}
+        names = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'name'))
+        codes = {}
+        for product_id, code in ProductBatch.objects.filter(product_id__in=product_ids).values_list('product_id', 'batch_code'):
+            codes.setdefault(product_id, []).append(code)
+        self.replace_products(product_ids, names, codes)
+        with self._lock:
+            self.version = max(self.version or 0, current)
+        return True
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Rebuilding the product search index failed")
+        finally:
+            connections.close_all()
+            self._refresh_lock.release()
+
+    def ensure_current(self):
+        """Bring the index up to date with the other processes' changes.
+
+        The first call builds it (other callers wait for that build). After
+        that, logged changes are applied for just the products they touch;
+        when the log can't be used (too far behind, expired, a bulk
+        invalidation) the index is rebuilt in a background thread while
+        lookups keep using the current one. Only one refresh runs at a time.
+        """
+        current = current_version()
+        if self.version is not None and self.version == current:
+            return
+        if not self.built:
+            with self._refresh_lock:
+                if not self.built:
+                    self.build()
+            return
+
+        if not self._refresh_lock.acquire(blocking=False):
+            return                        # another request is refreshing it
+        background = False
+        try:
+            # Without a cache (DummyCache) there is no log to follow: always rebuild
+            if current is not None and (self.version == current or self._catch_up(current)):
+                return
+            threading.Thread(
+                target=self._rebuild_in_background, name="search-index-rebuild", daemon=True,
+            ).start()
+            background = True
+        finally:
+            if not background:
+                self._refresh_lock.release()
+
+    # --- lookup ------------------------------------------------------
+    def name_contains(self, product_id, query):
+        """True if ``query`` is a (case-insensitive) substring of the product's name."""
+        return _normalize(query) in self.names.get(product_id, "")
+
+    def _word_candidates(self, word):
+        if len(word) < 3:
+            return set(self.prefixes.get(word, ()))
+        grams = sorted((self.trigrams.get(g, set()) for g in _trigrams(word)), key=len)
+        candidates = set(grams[0])
+        for ids in grams[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query, limit=10):
+        """Return ``[(product_id, matched_code_or_None), ...]`` best first."""
+        query = _normalize(query)
+        if not query:
+            return []
+        words = query.split()
+
+        with self._lock:
+            candidates = None
+            for word in words:
+                ids = self._word_candidates(word)
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+            ranked = []
+            for product_id in candidates:
+                name = self.names.get(product_id, "")
+                name_words = name.split()
+                code = next((c for c in self.codes.get(product_id, ()) if query in c), None)
+
+                if code == query:
+                    rank = 0              # exact batch code (scanned)
+                elif name.startswith(query):
+                    rank = 1              # name prefix
+                elif all(any(w.startswith(word) for w in name_words) for word in words):
+                    rank = 2              # every word starts a word of the name
+                elif all(word in name for word in words):
+                    rank = 3              # substring of the name
+                elif code is not None:
+                    rank = 4              # substring of a batch code
+                else:
+                    continue              # trigram false positive
+                if rank not in (0, 4):
+                    code = None           # matched on the name
+                ranked.append((rank, len(name), name, product_id, code))
+
+        ranked.sort()
+        return [(product_id, code) for _, _, _, product_id, code in ranked[:limit]]
+
+
+index = ProductSearchIndex()
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, seed(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _log_change(change):
+    """Append ``change`` (product ids, or REBUILD) to the log; return its number or None."""
+    try:
+        seq = cache.incr(VERSION_KEY)
+    except ValueError:
+        # Counter lost: restarting from the clock sends everyone a rebuild
+        cache.add(VERSION_KEY, seed(), timeout=None)
+        return None
+    cache.set(CHANGE_KEY.format(seq), change, timeout=CHANGE_TIMEOUT)
+    return seq
+
+
+def _after_commit(product_id, change):
+    def apply():
+        if index.built:
+            change()
+        new_version = _log_change([product_id])
+        # Still current if ours was the only change since the last refresh
+        with index._lock:
+            if new_version is not None and index.version is not None and new_version == index.version + 1:
+                index.version = new_version
+    transaction.on_commit(apply)
+
+
+def touch(*product_ids):
+    """Re-index ``product_ids`` everywhere (for writes that bypass the signals)."""
+    ids = sorted({pid for pid in product_ids if pid})
+    if ids:
+        transaction.on_commit(lambda: _log_change(ids))
+
+
+def invalidate():
+    """Make every process rebuild the whole index (in the background)."""
+    transaction.on_commit(lambda: _log_change(REBUILD))
+
+
+@receiver(post_init, sender=Product)
+def _remember_name(sender, instance, **kwargs):
+    instance._search_name = instance.name if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def _product_saved(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_search_name', None) == instance.name:
+        return
+    instance._search_name = instance.name
+    product_id, name = instance.pk, instance.name
+    _after_commit(product_id, lambda: index.add_product(product_id, name))
+
+
+@receiver(post_delete, sender=Product)
+def _product_deleted(sender, instance, **kwargs):
+    product_id = instance.pk
+    _after_commit(product_id, lambda: index.remove_product(product_id))
+
+
+@receiver(post_init, sender=ProductBatch)
+def _remember_code(sender, instance, **kwargs):
+    instance._search_code = instance.batch_code if instance.pk else None
+
+
+@receiver(post_save, sender=ProductBatch)
+def _batch_saved(sender, instance, created, **kwargs):
+    # Quantity/price edits are frequent and don't affect the index
+    old = getattr(instance, '_search_code', None)
+    if not created and old == instance.batch_code:
+        return
+    instance._search_code = instance.batch_code
+    product_id, code = instance.product_id, instance.batch_code
+
+    def change():
+        if old:
+            index.remove_code(product_id, old)
+        index.add_code(product_id, code)
+    _after_commit(product_id, change)
+
+
+@receiver(post_delete, sender=ProductBatch)
+def _batch_deleted(sender, instance, **kwargs):
+    product_id, code = instance.product_id, instance.batch_code
+    _after_commit(product_id, lambda: index.remove_code(product_id, code))
@@ -0,0 +1,114 @@
+"""The cache every process keeps its derived data in.
+
+Rollups, valuation counters, the low-stock set, report versions and the
+search index version are written by one worker (or a management command)
+and read by all the others, and several of them are moved with ``incr``.
+Any Django backend works, with these differences:
+
+* Redis and Memcached are shared by every process and increment
+  atomically: everything stays exact.
+* The database and file backends are shared too, but their ``incr`` is a
+  read followed by a write, so concurrent writers can lose an increment.
+  Version counters don't mind (any bump still changes them); the stock
+  valuation counters can drift until ``reconcile_stock_valuation`` runs.
+* Local memory is one copy per process: a write handled by one worker
+  only reaches that worker's derived data, the others catch up when their
+  entries expire. Fine for single-process setups (``runserver``, tests).
+* ``DummyCache`` keeps nothing; every read goes to the database, which is
+  slow but never stale.
+
+The first use logs a warning for the database, file and local-memory
+cases, since they are easy to end up with by accident (local memory is
+Django's default).
+
+Settings:
+
+* ``DERIVED_DATA_CACHE`` (default ``"default"``) - the ``CACHES`` alias to use.
+* ``DERIVED_DATA_CACHE_LOCAL`` (default False) - the deployment is a single
+  process: don't warn about a local-memory backend.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+
+logger = logging.getLogger(__name__)
+
+ATOMIC_BACKENDS = (
+    'django.core.cache.backends.redis.',
+    'django.core.cache.backends.memcached.',
+    'django_redis.',
+)
+NON_ATOMIC_BACKENDS = (
+    'django.core.cache.backends.db.',
+    'django.core.cache.backends.filebased.',
+)
+NO_CACHE_BACKENDS = (
+    'django.core.cache.backends.dummy.',
+)
+
+_checked = set()
+
+
+def alias():
+    return getattr(settings, 'DERIVED_DATA_CACHE', DEFAULT_CACHE_ALIAS)
+
+
+def backend():
+    return settings.CACHES.get(alias(), {}).get('BACKEND', '')
+
+
+def check():
+    """Log a warning when the derived-data cache can go stale or drift between processes."""
+    name, path = alias(), backend()
+    if path.startswith(ATOMIC_BACKENDS + NO_CACHE_BACKENDS):
+        return
+    if path.startswith(NON_ATOMIC_BACKENDS):
+        logger.warning(
+            "The '%s' cache (%s) increments non-atomically: concurrent writes can lose "
+            "stock valuation updates until reconcile_stock_valuation runs. Redis or "
+            "Memcached keep them exact.", name, path,
+        )
+    elif not getattr(settings, 'DERIVED_DATA_CACHE_LOCAL', False):
+        logger.warning(
+            "The '%s' cache (%s) is local to each process: derived report data changed "
+            "by one worker reaches the others only when their entries expire. Use Redis "
+            "or Memcached with several workers, or set DERIVED_DATA_CACHE_LOCAL = True "
+            "for single-process setups.", name, path,
+        )
+
+
+def is_shared():
+    """True when the derived-data cache is one store for every process (not local, not dummy)."""
+    return backend().startswith(ATOMIC_BACKENDS + NON_ATOMIC_BACKENDS)
+
+
+def get():
+    name = alias()
+    key = (name, backend(), getattr(settings, 'DERIVED_DATA_CACHE_LOCAL', False))
+    if key not in _checked:
+        check()
+        _checked.add(key)
+    return caches[name]
+
+
+class _DerivedCache:
+    """``django.core.cache.cache`` look-alike bound to the configured alias."""
+
+    def __getattr__(self, name):
+        return getattr(get(), name)
+
+
+cache = _DerivedCache()
+
+
+def seed():
+    """Starting value for a counter that is (re)created.
+
+    Counters start from the clock instead of 1, so a counter that was
+    evicted and created again never repeats a value it had before, and keys
+    or ETags built from the old values can't match again.
+    """
+    return time.time_ns() // 1000
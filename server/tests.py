@@ -0,0 +1,126 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import Category, Product, ProductBatch, Sale, SaleItem
+from .rounding import round_two
+from .shared_cache import cache
+from .views import ProfitReportView
+
+
+def legacy_profit(items):
+    """The per-item Decimal loop ProfitReportView ran before the grouped query."""
+    items = list(items.select_related('sale', 'batch', 'product'))
+    sale_totals = {}
+    for item in items:
+        sale_totals.setdefault(item.sale_id, Decimal('0.00'))
+        sale_totals[item.sale_id] += Decimal(item.quantity) * item.batch.selling_price
+
+    total_selling = Decimal('0.00')
+    total_buying = Decimal('0.00')
+    products = {}
+    for item in items:
+        sale_total = sale_totals[item.sale_id] or Decimal('0.00')
+        item_selling_price = Decimal(item.quantity) * item.batch.selling_price
+        proportion = item_selling_price / sale_total if sale_total > 0 else Decimal('0.00')
+        discounted_selling = proportion * item.sale.paid_amount
+        buying = Decimal(item.quantity) * item.batch.buying_price
+
+        total_selling += discounted_selling
+        total_buying += buying
+        entry = products.setdefault(item.product.name, [Decimal('0.00'), Decimal('0.00')])
+        entry[0] += discounted_selling
+        entry[1] += buying
+    return total_selling, total_buying, products
+
+
+class ProfitReportTests(TestCase):
+    view = staticmethod(ProfitReportView.as_view())
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='owner', password='secret')
+        category = Category.objects.create(name='Tests')
+
+        def batch(name, buying, selling):
+            product = Product.objects.create(name=name, category=category)
+            return ProductBatch.objects.create(
+                product=product, batch_code=f"T-{name}", expiry_date='2099-01-01',
+                quantity=1000, buying_price=Decimal(buying), selling_price=Decimal(selling),
+                wholesale_price=Decimal(selling),
+            )
+
+        cls.amoxicillin = batch('Amoxicillin', '600.00', '1000.00')
+        cls.paracetamol = batch('Paracetamol', '1800.00', '2500.00')
+        cls.sample = batch('Free sample', '50.00', '0.00')
+        cls.syrup = batch('Cough syrup', '210.55', '333.33')
+
+    def sale(self, lines, paid, status='confirmed'):
+        total = sum(Decimal(quantity) * b.selling_price for b, quantity in lines)
+        sale = Sale.objects.create(
+            total_amount=total, final_amount=total, paid_amount=Decimal(paid),
+            status=status, payment_status='paid', sale_type='retail', is_loan=False,
+        )
+        for b, quantity in lines:
+            SaleItem.objects.create(sale=sale, product=b.product, batch=b, quantity=quantity,
+                                    price_per_unit=b.selling_price)
+        return sale
+
+    def report(self):
+        cache.clear()
+        request = APIRequestFactory().get('/api/reports/profit/', {'period': 'daily'})
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assert_matches_legacy(self):
+        data = self.report()
+        items = SaleItem.objects.filter(sale__status='confirmed', sale__date__gte=self.period_start())
+        selling, buying, products = legacy_profit(items)
+
+        self.assertEqual(data['stockSelling'], round_two(selling))
+        self.assertEqual(data['stockBuying'], round_two(buying))
+        self.assertEqual(data['profit'], round_two(selling - buying))
+        self.assertEqual(
+            {row['name']: (row['selling_total'], row['buying_total'], row['profit']) for row in data['products']},
+            {name: (round_two(s), round_two(b), round_two(s - b)) for name, (s, b) in products.items()},
+        )
+        return data
+
+    def period_start(self):
+        from .periods import resolve
+        return resolve('daily').start
+
+    def test_discounted_multi_item_sale(self):
+        self.sale([(self.amoxicillin, 3), (self.paracetamol, 2)], paid='7000.00')
+        data = self.assert_matches_legacy()
+        self.assertEqual(data['stockSelling'], round_two(Decimal('7000.00')))
+
+    def test_uneven_discount_split(self):
+        # Shares that don't divide evenly into cents
+        self.sale([(self.amoxicillin, 1), (self.paracetamol, 1), (self.syrup, 7)], paid='5823.30')
+        self.sale([(self.syrup, 3)], paid='999.99')
+        self.assert_matches_legacy()
+
+    def test_zero_total_sale(self):
+        self.sale([(self.sample, 4)], paid='0.00')
+        self.sale([(self.sample, 2), (self.amoxicillin, 1)], paid='950.00')
+        data = self.assert_matches_legacy()
+        sample = next(row for row in data['products'] if row['name'] == 'Free sample')
+        self.assertEqual(sample['selling_total'], round_two(Decimal('0.00')))
+
+    def test_excludes_other_sales(self):
+        self.sale([(self.amoxicillin, 2)], paid='2000.00')
+        self.sale([(self.paracetamol, 5)], paid='12500.00', status='refunded')
+        old = self.sale([(self.syrup, 1)], paid='333.33')
+        Sale.objects.filter(pk=old.pk).update(date=self.period_start() - timedelta(seconds=1))
+        data = self.assert_matches_legacy()
+        self.assertEqual([row['name'] for row in data['products']], ['Amoxicillin'])
+
+    def test_empty_period(self):
+        data = self.assert_matches_legacy()
+        self.assertEqual(data['products'], [])
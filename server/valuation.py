@@ -0,0 +1,162 @@
+"""Running stock valuation counters.
+
+Total quantity, buying value and selling value of all ProductBatch rows are
+kept as integer counters (values in cents) in the shared derived-data cache
+(see ``shared_cache``) and moved by atomic ``incr`` deltas whenever a batch
+is saved or deleted, so reading the stock value no longer scans the batch
+table. ``reconcile()`` recomputes the real figures and reports any drift;
+it runs automatically when the counters are missing and periodically
+through the ``reconcile_stock_valuation`` command.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Sum, F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ProductBatch
+from .shared_cache import cache
+
+
+QUANTITY_KEY = "stock-valuation:quantity"
+BUYING_KEY = "stock-valuation:buying-cents"
+SELLING_KEY = "stock-valuation:selling-cents"
+KEYS = (QUANTITY_KEY, BUYING_KEY, SELLING_KEY)
+
+VALUE_FIELDS = frozenset(('quantity', 'buying_price', 'selling_price'))
+
+
+def _cents(value):
+    return int((Decimal(value or 0) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def _from_cents(value):
+    return (Decimal(value) / 100).quantize(Decimal("0.01"))
+
+
+def compute():
+    """Scan ProductBatch once and return the real counters."""
+    totals = ProductBatch.objects.aggregate(
+        quantity=Sum('quantity'),
+        buying=Sum(F('quantity') * F('buying_price')),
+        selling=Sum(F('quantity') * F('selling_price')),
+    )
+    return {
+        QUANTITY_KEY: int(totals['quantity'] or 0),
+        BUYING_KEY: _cents(totals['buying']),
+        SELLING_KEY: _cents(totals['selling']),
+    }
+
+
+def reconcile():
+    """Reset the counters from the database; return the drift that was found."""
+    cached = cache.get_many(KEYS)
+    actual = compute()
+    cache.set_many(actual, timeout=None)
+    return {
+        key: actual[key] - cached[key]
+        for key in KEYS
+        if key in cached and cached[key] != actual[key]
+    }
+
+
+def snapshot():
+    """Current stock quantity, buying value and selling value."""
+    counters = cache.get_many(KEYS)
+    if len(counters) != len(KEYS):
+        reconcile()
+        counters = cache.get_many(KEYS)
+        if len(counters) != len(KEYS):
+            # Cache unavailable (e.g. DummyCache): fall back to a direct scan
+            counters = compute()
+    return {
+        "quantity": counters[QUANTITY_KEY],
+        "buying": _from_cents(counters[BUYING_KEY]),
+        "selling": _from_cents(counters[SELLING_KEY]),
+    }
+
+
+def _apply(deltas):
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Counters not initialised yet; the next read reconciles them.
+            return
+
+
+def apply_delta(quantity=0, buying=0, selling=0):
+    """Move the counters once the current transaction commits.
+
+    ``buying`` and ``selling`` are value deltas (quantity * price) as Decimals.
+    """
+    deltas = {
+        QUANTITY_KEY: int(quantity),
+        BUYING_KEY: _cents(buying),
+        SELLING_KEY: _cents(selling),
+    }
+    transaction.on_commit(lambda: _apply(deltas))
+
+
+def invalidate():
+    """Drop the counters so the next read recomputes them."""
+    transaction.on_commit(lambda: cache.delete_many(KEYS))
+
+
+def _state(batch):
+    """``(quantity, buying_price, selling_price)``, or None if any of them is deferred."""
+    if VALUE_FIELDS & batch.get_deferred_fields():
+        # Reading them would cost a query per instance (.only()/.defer() querysets)
+        return None
+    return (batch.quantity, batch.buying_price, batch.selling_price)
+
+
+def _is_plain(state):
+    return state is not None and all(isinstance(v, (int, Decimal, float, str)) or v is None for v in state)
+
+
+def remember(batch):
+    """Take ``batch``'s current values as the baseline for its next save.
+
+    For instances whose row was already changed (and counted) by a queryset
+    update, e.g. in ``inventory``.
+    """
+    batch._valuation_state = _state(batch)
+
+
+@receiver(post_init, sender=ProductBatch)
+def _remember_state(sender, instance, **kwargs):
+    instance._valuation_state = _state(instance) if instance.pk else (0, 0, 0)
+
+
+@receiver(post_save, sender=ProductBatch)
+def _batch_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not VALUE_FIELDS & update_fields:
+        return
+    old = getattr(instance, '_valuation_state', (0, 0, 0))
+    new = _state(instance)
+    if not (_is_plain(old) and _is_plain(new)):
+        # F() expressions, deferred fields or other unknown values: can't compute a delta
+        invalidate()
+    else:
+        old_qty, old_buy, old_sell = (Decimal(str(v or 0)) for v in old)
+        new_qty, new_buy, new_sell = (Decimal(str(v or 0)) for v in new)
+        apply_delta(
+            quantity=new_qty - old_qty,
+            buying=new_qty * new_buy - old_qty * old_buy,
+            selling=new_qty * new_sell - old_qty * old_sell,
+        )
+    instance._valuation_state = new
+
+
+@receiver(post_delete, sender=ProductBatch)
+def _batch_deleted(sender, instance, **kwargs):
+    old = getattr(instance, '_valuation_state', _state(instance))
+    if not _is_plain(old):
+        invalidate()
+        return
+    qty, buy, sell = (Decimal(str(v or 0)) for v in old)
+    apply_delta(quantity=-qty, buying=-qty * buy, selling=-qty * sell)
@@ -1,18 +1,24 @@
-from email.utils import parsedate
 from django.shortcuts import get_object_or_404
 import django_filters
 from rest_framework import viewsets, permissions, filters, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import CursorPagination
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.http import JsonResponse
-from django.db import transaction
-from django.db.models import Sum, Count, F
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear, ExtractMonth, Coalesce
-from datetime import timedelta
-from django.utils.timezone import now
+from django.http import Http404, JsonResponse
+from django.core.exceptions import PermissionDenied
+import random
+import time
+from django.db import DatabaseError, DataError, IntegrityError, OperationalError, transaction
+from django.db.models import Sum, Count, Min, F, Q, Value
+from django.db.models.functions import Coalesce
+from datetime import datetime, timedelta
+import csv
+import json
+from django.utils.timezone import now, make_aware
+from django.utils.dateparse import parse_date
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
@@ -20,6 +26,8 @@ from decimal import Decimal, InvalidOperation
 from django_filters.rest_framework import DjangoFilterBackend
 from .pagination import OrderPagination, ProductPagination
 from .rounding import round_two
+from . import batch_lookup, customer_stats, inventory, lowstock, periods, report_cache, rollups, search_index, valuation
+from .report_cache import cached_report, conditional_report
 
 
 
@@ -149,11 +157,34 @@ class CategoryViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
 
 
+class OptInCursorPagination(CursorPagination):
+    """Keyset (cursor) paging that only kicks in when asked for.
+
+    The list is only paginated when the client sends ``cursor`` or
+    ``page_size``, so existing callers still get the plain list.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().get_page_size(request)
+
+
+class ProductCursorPagination(OptInCursorPagination):
+    # Cursor paging on (created_at, id), newest first
+    ordering = ('-created_at', '-id')
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
     # pagination_class = ProductPagination
+    pagination_class = ProductCursorPagination
     filter_backends = [
         django_filters.rest_framework.DjangoFilterBackend,
         filters.SearchFilter,
@@ -163,6 +194,30 @@ class ProductViewSet(viewsets.ModelViewSet):
     search_fields = ['name']
     ordering_fields = ['created_at']
 
+    def requested_fields(self):
+        # ?fields=id,name,batches -> sparse fieldset for GET requests
+        raw = self.request.query_params.get('fields') if self.request else None
+        if not raw or self.request.method != 'GET':
+            return None
+        return {name.strip() for name in raw.split(',') if name.strip()}
+
+    def get_queryset(self):
+        queryset = Product.objects.select_related('category')
+        fields = self.requested_fields()
+        # Nested batches are fetched in one extra query, not one per product
+        if fields is None or 'batches' in fields:
+            queryset = queryset.prefetch_related('batches')
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.requested_fields()
+        if fields:
+            target = getattr(serializer, 'child', serializer)
+            for name in set(target.fields) - fields:
+                target.fields.pop(name)
+        return serializer
+
     def perform_create(self, serializer):
         # Save product and rely on nested batch serializer to handle batches
         serializer.save()
@@ -190,8 +245,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         if ProductBatch.objects.filter(product=product, batch_code=batch_code).exists():
             return Response({"detail": f"Batch code '{batch_code}' already exists for this product."}, status=400)
 
-        # ✅ Create new batch
-        new_batch = ProductBatch.objects.create(
+        # ✅ Create new batch with its stock + 'added' ledger entry
+        new_batch = ProductBatch(
             product=product,
             batch_code=batch_code,
             expiry_date=expiry_date,
@@ -199,21 +254,8 @@ class ProductViewSet(viewsets.ModelViewSet):
             selling_price=selling_price,
             wholesale_price=wholesale_price,
             recorded_by=request.user,
-            quantity=0
-        )
-
-        # ✅ Update quantity
-        new_batch.quantity += quantity
-        new_batch.save()
-
-        # ✅ Now log stock entry MANUALLY
-        StockEntry.objects.create(
-            product=product,
-            batch=new_batch,  # 👈 ensures correct batch
-            entry_type='added',
-            quantity=quantity,
-            recorded_by=request.user
         )
+        inventory.receive([(new_batch, quantity)], request.user)
 
         return Response({
             "detail": "New batch added and stock logged.",
@@ -233,19 +275,13 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Batch ID required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            batch = product.batches.get(id=batch_id)
+            batch = product.batches.select_for_update().get(id=batch_id)
         except ProductBatch.DoesNotExist:
             return Response({"detail": "Batch not found for this product."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Optional: Log deletion
+        # Log what is left as deleted
         if batch.quantity > 0:
-            StockEntry.objects.create(
-                product=product,
-                batch=batch,
-                entry_type='deleted',
-                quantity=batch.quantity,
-                recorded_by=request.user
-            )
+            inventory.write_off([(batch, batch.quantity)], request.user)
 
         batch.delete()
 
@@ -260,35 +296,339 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Batch ID required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            batch = product.batches.get(id=batch_id)
+            batch = product.batches.select_for_update().get(id=batch_id)
         except ProductBatch.DoesNotExist:
             return Response({"detail": "Batch not found for this product."}, status=status.HTTP_404_NOT_FOUND)
 
         serializer = ProductBatchSerializer(batch, data=request.data, partial=True, context={'request': request})
         serializer.is_valid(raise_exception=True)
+
+        # Quantity changes are applied as a logged adjustment, the rest is saved as usual
+        if 'quantity' in serializer.validated_data:
+            target = serializer.validated_data.pop('quantity')
+            inventory.adjust([(batch, target - batch.quantity)], request.user)
         serializer.save()
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     
+    @action(detail=False, methods=['post'], url_path='import-batches', permission_classes=[IsAdminOnly])
+    def import_batches(self, request):
+        """Bulk-add batches from an uploaded CSV or JSON-lines file (field ``file``).
+
+        Send ``file_type`` (csv/jsonl) or let the file extension decide.
+        Each line needs product (id), batch_code, expiry_date, quantity,
+        buying_price, selling_price and optionally wholesale_price. Lines are
+        parsed as a stream and written in chunks; bad lines are reported
+        back and skipped without aborting the rest of the file.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Upload the file in the 'file' field."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Not "format": DRF reserves ?format= for content negotiation
+        fmt = (request.data.get('file_type') or '').lower()
+        if not fmt:
+            fmt = 'jsonl' if upload.name.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+        if fmt not in ('csv', 'jsonl', 'ndjson'):
+            return Response({"detail": "file_type must be csv or jsonl."}, status=status.HTTP_400_BAD_REQUEST)
+
+        created = 0
+        errors = []
+        lines = 0
+        try:
+            for chunk in _chunked(_iter_batch_rows(upload, fmt), BATCH_IMPORT_CHUNK_SIZE):
+                lines += len(chunk)
+                chunk_created, chunk_errors = _import_batch_chunk(chunk, request.user)
+                created += chunk_created
+                errors.extend(chunk_errors)
+        except UndecodableLine as e:
+            # Earlier chunks are already saved: say how far the import got
+            return Response({
+                "detail": str(e),
+                "line": e.line_number,
+                "lines": lines,
+                "created": created,
+                "failed": len(errors),
+                "errors": errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "lines": lines,
+            "created": created,
+            "failed": len(errors),
+            "errors": errors,
+        }, status=status.HTTP_200_OK)
+
+    suggest_max_limit = 50
+
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def suggest(self, request):
+        """Typeahead for the till: ``?q=amox&limit=10`` over names and batch codes."""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.suggest_max_limit)
+        except (TypeError, ValueError):
+            return Response({"detail": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        search_index.index.ensure_current()
+        matches = search_index.index.search(query, limit=max(limit, 1))
+        if not matches:
+            return Response([])
+
+        # Current price (first-expiring batch in stock) and stock in one query
+        ids = [product_id for product_id, _ in matches]
+        stock = {}
+        for row in (
+            ProductBatch.objects.filter(product_id__in=ids, quantity__gt=0)
+            .order_by('product_id', 'expiry_date', 'id')
+            .values('product_id', 'product__name', 'batch_code', 'selling_price', 'wholesale_price', 'quantity')
+        ):
+            entry = stock.setdefault(row['product_id'], {**row, 'stock': 0})
+            entry['stock'] += row['quantity']
+
+        names = dict(Product.objects.filter(id__in=ids).values_list('id', 'name')) if len(stock) < len(ids) else {}
+        results = []
+        for product_id, code in matches:
+            entry = stock.get(product_id)
+            results.append({
+                "id": product_id,
+                "name": entry['product__name'] if entry else names.get(product_id, ""),
+                "matched_batch_code": code,
+                "price": entry['selling_price'] if entry else None,
+                "wholesale_price": entry['wholesale_price'] if entry else None,
+                "stock": entry['stock'] if entry else 0,
+            })
+        return Response(results)
+
     def perform_update(self, serializer):
         # We no longer track stock on the Product level directly
         serializer.save()
 
+    @transaction.atomic
     def perform_destroy(self, instance):
-        # Log deletion (note: quantity is now per batch)
-        for batch in instance.batches.all():
-            if batch.quantity > 0:
-                StockEntry.objects.create(
-                    product=instance,
-                    batch=batch,
-                    entry_type='deleted',
-                    quantity=batch.quantity,
-                    recorded_by=self.request.user
-                )
+        # Log deletion (note: quantity is now per batch), one ledger insert for all batches
+        batches = instance.batches.select_for_update().filter(quantity__gt=0)
+        inventory.write_off([(batch, batch.quantity) for batch in batches], self.request.user)
         instance.delete()
 
 
+# Bulk batch import helpers (ProductViewSet.import_batches)
+BATCH_IMPORT_CHUNK_SIZE = 500
+
+
+class UndecodableLine(ValueError):
+    def __init__(self, line_number):
+        self.line_number = line_number
+        super().__init__(f"Line {line_number} is not valid UTF-8. Save the file as UTF-8 (CSV UTF-8 in Excel) and upload it again.")
+
+
+def _decoded_lines(upload):
+    for index, line in enumerate(upload):
+        try:
+            yield line.decode('utf-8-sig' if index == 0 else 'utf-8')
+        except UnicodeDecodeError:
+            raise UndecodableLine(index + 1)
+
+
+def _iter_batch_rows(upload, fmt):
+    """Yield ``(line_number, row_dict_or_None, error)`` from the upload, one line at a time."""
+    text = _decoded_lines(upload)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, {"detail": f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, {"detail": "Each line must be a JSON object."}
+            continue
+        yield line_number, row, None
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _clean_batch_row(row):
+    errors = {}
+    cleaned = {}
+
+    product = row.get('product', row.get('product_id'))
+    try:
+        cleaned['product_id'] = int(product)
+    except (TypeError, ValueError):
+        errors['product'] = "A valid product id is required."
+
+    batch_code = str(row.get('batch_code') or '').strip()
+    if batch_code:
+        cleaned['batch_code'] = batch_code
+    else:
+        errors['batch_code'] = "This field is required."
+
+    try:
+        expiry_date = parse_date(str(row.get('expiry_date') or '').strip())
+    except ValueError:
+        # Well-formed but not a real day (2025-02-30)
+        expiry_date = None
+    if expiry_date:
+        cleaned['expiry_date'] = expiry_date
+    else:
+        errors['expiry_date'] = "Use YYYY-MM-DD."
+
+    try:
+        cleaned['quantity'] = int(row.get('quantity'))
+        if cleaned['quantity'] <= 0:
+            errors['quantity'] = "Quantity must be positive."
+    except (TypeError, ValueError):
+        errors['quantity'] = "A whole number is required."
+
+    for field, required in (('buying_price', True), ('selling_price', True), ('wholesale_price', False)):
+        raw = row.get(field)
+        if raw in (None, ''):
+            if required:
+                errors[field] = "This field is required."
+            else:
+                cleaned[field] = Decimal('0')
+            continue
+        try:
+            cleaned[field] = Decimal(str(raw).strip())
+        except InvalidOperation:
+            errors[field] = "A valid number is required."
+            continue
+        if not cleaned[field].is_finite():
+            errors[field] = "A valid number is required."
+        elif cleaned[field] < 0:
+            errors[field] = "Must not be negative."
+
+    return cleaned, errors
+
+
+def _write_batches(batches, user):
+    """Insert ``batches`` and one 'added' ledger row each."""
+    ProductBatch.objects.bulk_create(batches)
+    # MySQL doesn't return ids from bulk inserts: read them back by (product, batch code)
+    ids = {
+        (product_id, batch_code): pk
+        for pk, product_id, batch_code in ProductBatch.objects.filter(
+            product_id__in={b.product_id for b in batches},
+            batch_code__in={b.batch_code for b in batches},
+        ).values_list('id', 'product_id', 'batch_code')
+    }
+    for batch in batches:
+        batch.pk = ids[(batch.product_id, batch.batch_code)]
+    StockEntry.objects.bulk_create([
+        StockEntry(
+            product_id=batch.product_id,
+            batch_id=batch.pk,
+            entry_type='added',
+            quantity=batch.quantity,
+            recorded_by=user,
+        )
+        for batch in batches
+    ])
+
+
+def _import_batch_chunk(chunk, user):
+    """Validate and write one chunk; return ``(created_count, errors)``."""
+    errors = []
+    candidates = []
+    for line_number, row, parse_error in chunk:
+        if parse_error:
+            errors.append({"line": line_number, "errors": parse_error})
+            continue
+        cleaned, row_errors = _clean_batch_row(row)
+        if row_errors:
+            errors.append({"line": line_number, "errors": row_errors})
+            continue
+        candidates.append((line_number, cleaned))
+
+    if not candidates:
+        return 0, errors
+
+    # Set-based checks: one query for products, one for existing batch codes
+    product_ids = {c['product_id'] for _, c in candidates}
+    known_products = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    taken = set(
+        ProductBatch.objects
+        .filter(product_id__in=product_ids, batch_code__in={c['batch_code'] for _, c in candidates})
+        .values_list('product_id', 'batch_code')
+    )
+
+    def code_taken(line_number, batch_code):
+        errors.append({"line": line_number, "errors": {
+            "batch_code": f"Batch code '{batch_code}' already exists for this product."
+        }})
+
+    batches = []
+    for line_number, cleaned in candidates:
+        key = (cleaned['product_id'], cleaned['batch_code'])
+        if cleaned['product_id'] not in known_products:
+            errors.append({"line": line_number, "errors": {"product": "Product not found."}})
+        elif key in taken:
+            code_taken(line_number, cleaned['batch_code'])
+        else:
+            taken.add(key)  # also catches duplicates inside the file
+            batches.append((line_number, ProductBatch(recorded_by=user, **cleaned)))
+
+    if not batches:
+        return 0, errors
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                _write_batches([batch for _, batch in batches], user)
+            created = [batch for _, batch in batches]
+        except (IntegrityError, DataError):
+            # A concurrent import took some of these codes after the check, or a
+            # value doesn't fit its column: go line by line to find which
+            created = []
+            for line_number, batch in batches:
+                try:
+                    with transaction.atomic():
+                        _write_batches([batch], user)
+                except IntegrityError:
+                    batch.pk = None
+                    code_taken(line_number, batch.batch_code)
+                except DataError:
+                    batch.pk = None
+                    errors.append({"line": line_number, "errors": {
+                        "detail": "A value is too long or out of range (batch code length, price digits)."
+                    }})
+                else:
+                    created.append(batch)
+        if not created:
+            return 0, errors
+
+        # bulk_create sends no signals: update the derived stock data ourselves
+        valuation.apply_delta(
+            quantity=sum(b.quantity for b in created),
+            buying=sum(b.quantity * b.buying_price for b in created),
+            selling=sum(b.quantity * b.selling_price for b in created),
+        )
+        lowstock.schedule_recheck(*{b.product_id for b in created})
+        report_cache.bump('stock')
+        search_index.touch(*{b.product_id for b in created})
+        batch_lookup.forget(*{b.batch_code for b in created})
+
+    return len(created), errors
+
+
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
@@ -298,18 +638,34 @@ class CustomerViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'name']
 
 
+class CustomerPurchasePagination(CursorPagination):
+    # Newest purchases first; sale_date is annotated by the view
+    ordering = ('-sale_date', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def customer_purchases(request, customer_id):
     customer = get_object_or_404(Customer, id=customer_id)
-    # Fetch all sale items for this customer
-    # Assuming SaleItem has a foreign key to Sale, and Sale has a foreign key to Customer
-    sale_items = SaleItem.objects.filter(sale__customer=customer)
+    sale_items = (
+        SaleItem.objects.filter(sale__customer=customer)
+        .select_related('sale', 'product', 'batch')
+        .annotate(sale_date=F('sale__date'))
+    )
+
+    paginator = CustomerPurchasePagination()
+    page = paginator.paginate_queryset(sale_items, request)
+    serializer = SaleItemSerializer(page, many=True)
 
-    serializer = SaleItemSerializer(sale_items, many=True)
-    return Response(serializer.data)
+    response = paginator.get_paginated_response(serializer.data)
+    # 📇 Lifetime figures come with every page, from the cache
+    response.data = {"customer": customer_stats.customer_stats(customer.id), **response.data}
+    return response
 
 
 class ProductBatchViewSet(viewsets.ModelViewSet):
@@ -317,10 +673,36 @@ class ProductBatchViewSet(viewsets.ModelViewSet):
     serializer_class = ProductBatchSerializer
     permission_classes = [IsAdminOnly]  # or your custom permission
 
+    scan_max_codes = 200
+
     def partial_update(self, request, *args, **kwargs):
         # This handles PATCH /api/batches/{id}/
         return super().partial_update(request, *args, **kwargs)
 
+    @action(detail=False, methods=['get'], url_path=r'scan/(?P<code>[^/]+)', permission_classes=[IsAuthenticated])
+    def scan(self, request, code=None):
+        # GET /api/batches/scan/<code>/ -> batch, product, prices and quantity
+        rows = batch_lookup.resolve([code]).get(code.strip(), [])
+        if not rows:
+            return Response({"detail": f"No batch with code '{code}'."}, status=status.HTTP_404_NOT_FOUND)
+        # Codes are unique per product only; the first-expiring match comes first
+        return Response({**rows[0], "matches": len(rows)})
+
+    @action(detail=False, methods=['post'], url_path='scan', permission_classes=[IsAuthenticated])
+    def scan_basket(self, request):
+        # POST /api/batches/scan/ {"codes": [...]} -> one entry per code (null if unknown)
+        codes = request.data.get('codes')
+        if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+            return Response({"detail": "codes must be a list of strings."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(codes) > self.scan_max_codes:
+            return Response({"detail": f"At most {self.scan_max_codes} codes per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = batch_lookup.resolve(codes)
+        return Response({
+            code: (found.get(code.strip()) or [None])[0]
+            for code in codes
+        })
+
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -344,29 +726,35 @@ class RefundViewSet(viewsets.ModelViewSet):
     search_fields = ['sale__id', 'refunded_by__username']
     ordering_fields = ['refund_date', 'refund_amount']
 
+    def _move_refund_total(self, sale_id, amount):
+        if amount:
+            Sale.objects.filter(pk=sale_id).update(
+                refund_total=Coalesce(F('refund_total'), Value(Decimal('0'))) + amount
+            )
+
     @transaction.atomic
     def perform_create(self, serializer):
-        refund = serializer.save(refunded_by=self.request.user)
-        product = refund.product
-
-        if refund.batch:
-            batch = refund.batch
-            batch.quantity += refund.quantity
-            batch.save()
-        else:
-            product.quantity_in_stock += refund.quantity
-            product.save()
-
-        StockEntry.objects.create(
-            product=product,
-            batch=refund.batch if refund.batch else None,
-            entry_type='added',
-            quantity=refund.quantity,
-            recorded_by=self.request.user
-        )
-        sale = refund.sale
-        sale.refund_total = (sale.refund_total or 0) + refund.refund_amount
-        sale.save()
+        refund = Refund(refunded_by=self.request.user, **serializer.validated_data)
+        # Lock the sale: refunds of one sale queue up behind each other
+        sale = Sale.objects.select_for_update().get(pk=refund.sale_id)
+
+        # bulk_create skips the model's stock logic, the inventory service
+        # restores the batch instead (as in SaleViewSet.refund)
+        Refund.objects.bulk_create([refund])
+        if refund.pk is None:
+            # MySQL doesn't return ids from bulk inserts; the sale lock makes the newest one ours
+            refund.pk = Refund.objects.filter(sale_id=sale.pk).latest('pk').pk
+        serializer.instance = refund
+
+        # Refunds without a batch predate per-batch stock: nothing to restore
+        if refund.batch_id:
+            inventory.restore([(refund.batch, refund.quantity)], self.request.user)
+        self._move_refund_total(sale.pk, refund.refund_amount or 0)
+
+        # No signals from bulk_create or update()
+        rollups.touch_sale(sale)
+        customer_stats.invalidate(sale.customer_id)
+        report_cache.bump('sales')
 
     @transaction.atomic
     def perform_update(self, serializer):
@@ -374,23 +762,43 @@ class RefundViewSet(viewsets.ModelViewSet):
 
     @transaction.atomic
     def perform_destroy(self, instance):
-        product = instance.product
+        if instance.batch_id:
+            inventory.write_off([(instance.batch, instance.quantity)], self.request.user)
+        self._move_refund_total(instance.sale_id, -(instance.refund_amount or 0))
+        instance.delete()
 
-        if instance.batch:
-            batch = instance.batch
-            batch.quantity -= instance.quantity
-            batch.save()
-        else:
-            product.quantity_in_stock -= instance.quantity
-            product.save()
 
-        sale = instance.sale
-        sale.refund_total = (sale.refund_total or 0) - instance.refund_amount
-        sale.save()
 
-        instance.delete()
+# Postgres: serialization_failure, deadlock_detected. MySQL: lock wait timeout, deadlock.
+RETRYABLE_PGCODES = {'40001', '40P01'}
+RETRYABLE_MYSQL_ERRNOS = {1205, 1213}
+
+
+def is_retryable_db_error(exc):
+    cause = exc.__cause__ or exc
+    if getattr(cause, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    args = getattr(cause, 'args', ())
+    return bool(args) and args[0] in RETRYABLE_MYSQL_ERRNOS
 
 
+def lock_order_batches(order_ids):
+    """Lock every batch the given orders can draw from, always in id order.
+
+    Cashiers confirming orders that share batches then queue on the same
+    rows in the same order instead of deadlocking each other.
+    """
+    product_ids = (
+        Order.objects.filter(id__in=order_ids)
+        .values_list('items__product_id', flat=True)
+    )
+    return list(
+        ProductBatch.objects.select_for_update()
+        .filter(product_id__in=product_ids)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
@@ -426,17 +834,141 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({"error": "Only admin can delete orders via this endpoint."}, status=403)
         return super().destroy(request, *args, **kwargs)
 
-    @action(detail=True, methods=['post'], permission_classes=[IsCashierOrAdmin])
-    @transaction.atomic
-    def confirm(self, request, pk=None):
+    confirm_max_attempts = 3
+    confirm_bulk_limit = 500
+
+    def _with_retry(self, func):
+        # Each attempt is its own transaction so a deadlock/serialization
+        # failure can simply be replayed.
+        for attempt in range(1, self.confirm_max_attempts + 1):
+            try:
+                with transaction.atomic():
+                    return func()
+            except OperationalError as e:
+                if attempt == self.confirm_max_attempts or not is_retryable_db_error(e):
+                    raise
+                time.sleep(0.05 * attempt + random.uniform(0, 0.05))
+
+    def _lock_orders(self, order_ids):
+        # Lock the orders first (no double confirms), then their batches in id order
+        list(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        return lock_order_batches(order_ids)
+
+    def _confirm_locked(self, request, data, batch_ids):
         serializer = ConfirmOrderSerializer(
-            data=request.data,
+            data=data,
             context={'request': request, 'view': self}
         )
         serializer.is_valid(raise_exception=True)
         sale = serializer.save()
+
+        # Oversell guard: roll the confirmation back rather than go negative
+        if ProductBatch.objects.filter(id__in=batch_ids, quantity__lt=0).exists():
+            raise ValidationError({"detail": "Insufficient stock to confirm this order."})
+        return sale
+
+    @action(detail=True, methods=['post'], permission_classes=[IsCashierOrAdmin])
+    def confirm(self, request, pk=None):
+        order = self.get_object()
+
+        def run():
+            batch_ids = self._lock_orders([order.pk])
+            return self._confirm_locked(request, request.data, batch_ids)
+
+        sale = self._with_retry(run)
         return Response(SaleSerializer(sale).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='confirm-bulk', permission_classes=[IsCashierOrAdmin])
+    def confirm_bulk(self, request):
+        """Confirm many orders in one request: ``{"orders": [{"order_id": 1, ...}, ...]}``.
+
+        Each entry carries the same fields as a single ``confirm`` call.
+        Orders and batches are locked once for the whole set, and each order
+        runs in its own savepoint so one failure (validation, not found,
+        permission, integrity or other database error) doesn't undo the
+        others: every order gets a result.
+        """
+        entries = request.data.get('orders')
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "orders must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > self.confirm_bulk_limit:
+            return Response({"error": f"At most {self.confirm_bulk_limit} orders per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        def order_id_of(entry):
+            try:
+                return int(entry.get('order_id'))
+            except (AttributeError, TypeError, ValueError):
+                return None
+
+        # Validate the whole set in one pass (one query for all orders)
+        requested = [(order_id_of(entry), entry) for entry in entries]
+        orders = self.get_queryset().in_bulk([oid for oid, _ in requested if oid is not None])
+
+        results = []
+        todo = []
+        seen = set()
+        for order_id, entry in requested:
+            result = {"order_id": order_id}
+            order = orders.get(order_id)
+            if order is None:
+                result.update(status="error", errors={"detail": "Order not found."})
+            elif order_id in seen:
+                result.update(status="error", errors={"detail": "Order listed more than once."})
+            elif order.status == 'confirmed':
+                result.update(status="error", errors={"detail": "Order already confirmed."})
+            else:
+                todo.append((order_id, entry, result))
+            seen.add(order_id)
+            results.append(result)
+
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        original_kwargs = dict(self.kwargs)
+
+        def run():
+            outcomes = {}
+            batch_ids = self._lock_orders([order_id for order_id, _, _ in todo])
+            for order_id, entry, _ in todo:
+                # ConfirmOrderSerializer resolves its order through the view
+                self.kwargs = {**original_kwargs, lookup: str(order_id)}
+                data = {key: value for key, value in entry.items() if key != 'order_id'}
+                try:
+                    with transaction.atomic():
+                        sale = self._confirm_locked(request, data, batch_ids)
+                except ValidationError as e:
+                    outcomes[order_id] = {"status": "error", "errors": e.detail}
+                except APIException as e:
+                    outcomes[order_id] = {"status": "error", "errors": {"detail": e.detail}}
+                except (Http404, PermissionDenied) as e:
+                    outcomes[order_id] = {"status": "error", "errors": {"detail": str(e) or type(e).__name__}}
+                except DatabaseError as e:
+                    # Deadlocks/serialization failures replay the whole set (_with_retry)
+                    if is_retryable_db_error(e):
+                        raise
+                    outcomes[order_id] = {"status": "error", "errors": {"detail": "Could not be saved (database error)."}}
+                else:
+                    outcomes[order_id] = {"status": "confirmed", "sale_id": sale.id}
+            return outcomes
+
+        if todo:
+            try:
+                outcomes = self._with_retry(run)
+            finally:
+                self.kwargs = original_kwargs
+            for order_id, _, result in todo:
+                result.update(outcomes[order_id])
+
+        confirmed = sum(1 for r in results if r["status"] == "confirmed")
+        return Response({
+            "confirmed": confirmed,
+            "failed": len(results) - confirmed,
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['patch'], permission_classes=[IsStaffOrAdmin])
     def update_rejected(self, request, pk=None):
         order = self.get_object()
@@ -529,22 +1061,31 @@ class SaleViewSet(viewsets.ReadOnlyModelViewSet):
         if now() > refund_deadline:
             return Response({"detail": "Refund window expired. Cannot refund this sale."}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Lock the sale so two tills can't refund it twice
+        sale = Sale.objects.select_for_update().get(pk=sale.pk)
+
         if sale.status == 'refunded':
             return Response({"detail": "Sale already refunded."}, status=status.HTTP_400_BAD_REQUEST)
 
         if sale.paid_amount <= 0:
             return Response({"detail": "This sale was not paid. Cannot process refund."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 🔁 Create Refunds (stock logic handled in model)
-        for item in sale.items.all():
-            Refund.objects.create(
+        items = list(sale.items.select_related('batch'))
+
+        # 🔁 Create Refunds in one insert (bulk_create skips the model's stock logic,
+        # the inventory service restores the batches instead)
+        Refund.objects.bulk_create([
+            Refund(
                 sale=sale,
-                product=item.product,
-                batch=item.batch,
+                product_id=item.product_id,
+                batch_id=item.batch_id,
                 quantity=item.quantity,
                 refund_amount=0,  # not used anymore
                 refunded_by=request.user,
             )
+            for item in items
+        ])
+        inventory.restore([(item.batch, item.quantity) for item in items if item.batch_id], request.user)
 
         # 💸 Set refund summary info on Sale
         sale.status = 'refunded'
@@ -559,16 +1100,90 @@ class SaleViewSet(viewsets.ReadOnlyModelViewSet):
             cashier=request.user,
             payment_method="refund"
         )
+        rollups.touch_sale(sale)
+        report_cache.bump('sales')
 
         return Response({"detail": f"Sale refunded. Refunded amount: {sale.paid_amount} TZS"}, status=status.HTTP_200_OK)
 
 
 
 
+from django.db.models import Case, When, ExpressionWrapper, DecimalField
+
+LOAN_AGING_BUCKETS = (
+    # (key, min age in days, max age in days)
+    ("0_30", 0, 30),
+    ("31_60", 31, 60),
+    ("61_90", 61, 90),
+    ("90_plus", 91, None),
+)
+
+
+def outstanding_expr():
+    return ExpressionWrapper(
+        F('final_amount') - F('paid_amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
 class LoanViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Sale.objects.filter(is_loan=True).exclude(status='refunded').exclude(payment_status='paid')
     serializer_class = LoanSerializer
     permission_classes = [IsCashierOrAdmin]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['date', 'outstanding']
+
+    def get_queryset(self):
+        # Balance computed by the database, so it can be sorted on
+        return super().get_queryset().select_related('customer').annotate(outstanding=outstanding_expr())
+
+    @action(detail=False, methods=['get'], url_path='aging')
+    def aging(self, request):
+        """Open loan balances per customer, bucketed by the age of the sale."""
+        today = timezone.localdate()
+
+        def older_than(days):
+            # Start of the local day ``days`` ago: ages are whole calendar days
+            return periods.local_midnight(today - timedelta(days=days - 1))
+
+        aggregates = {}
+        for key, low, high in LOAN_AGING_BUCKETS:
+            age_q = Q(date__lt=older_than(low)) if low else Q()
+            if high is not None:
+                age_q &= Q(date__gte=older_than(high + 1))
+            aggregates[key] = Coalesce(Sum(outstanding_expr(), filter=age_q), Value(Decimal('0')))
+
+        rows = (
+            self.queryset
+            .filter(final_amount__gt=F('paid_amount'))
+            .values('customer_id', 'customer__name')
+            .annotate(loans=Count('id'), oldest=Min('date'), **aggregates)
+            .order_by('customer__name', 'customer_id')
+        )
+
+        keys = [key for key, _, _ in LOAN_AGING_BUCKETS]
+        customers = []
+        totals = {key: Decimal('0') for key in keys}
+        for row in rows:
+            buckets = {key: round_two(row[key]) for key in keys}
+            for key in keys:
+                totals[key] += row[key]
+            customers.append({
+                "customer_id": row['customer_id'],
+                "customer": row['customer__name'] or "Walk-in",
+                "loans": row['loans'],
+                "oldest": row['oldest'],
+                "buckets": buckets,
+                "total": round_two(sum(row[key] for key in keys)),
+            })
+
+        customers.sort(key=lambda c: c['total'], reverse=True)
+        return Response({
+            "as_of": today,
+            "customers": customers,
+            "totals": {key: round_two(value) for key, value in totals.items()},
+            "total": round_two(sum(totals.values())),
+        })
 
     @action(detail=True, methods=['post'], url_path='pay')
     def pay_loan(self, request, pk=None):
@@ -586,16 +1201,38 @@ class LoanViewSet(viewsets.ReadOnlyModelViewSet):
         if amount <= 0:
             return Response({"error": "Amount must be greater than 0"}, status=status.HTTP_400_BAD_REQUEST)
 
-        remaining = sale.final_amount - sale.paid_amount
-        if amount > remaining:
-            return Response({"error": "Payment exceeds remaining balance"}, status=status.HTTP_400_BAD_REQUEST)
-
+        # One conditional UPDATE: the balance check and the increment happen
+        # on the row itself, so concurrent payments can't overpay or overwrite
+        # each other. payment_status is listed first because MySQL applies
+        # SET clauses left to right.
+        new_paid = F('paid_amount') + amount
         with transaction.atomic():
-            sale.paid_amount += amount
-            sale.payment_status = "paid" if sale.paid_amount >= sale.final_amount else "partial"
-            sale.save()
+            updated = (
+                self.queryset
+                .filter(pk=sale.pk, final_amount__gte=new_paid)
+                .update(
+                    payment_status=Case(
+                        When(final_amount__lte=new_paid, then=Value('paid')),
+                        default=Value('partial'),
+                    ),
+                    paid_amount=new_paid,
+                )
+            )
+            if not updated:
+                return Response({"error": "Payment exceeds remaining balance"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # update() sends no signals
+            rollups.touch_sale(sale)
+            report_cache.bump('sales')
+            customer_stats.invalidate(sale.customer_id)
 
-        return Response({"message": "Payment recorded successfully"}, status=status.HTTP_200_OK)
+        sale.refresh_from_db(fields=['paid_amount', 'payment_status'])
+        return Response({
+            "message": "Payment recorded successfully",
+            "paid_amount": sale.paid_amount,
+            "remaining": sale.final_amount - sale.paid_amount,
+            "payment_status": sale.payment_status,
+        }, status=status.HTTP_200_OK)
 
 
 #Update ExpenseViewSet` to filter expenses by date range
@@ -613,39 +1250,106 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         end_date_str = request.query_params.get('end_date')
 
         # Default to today if no date range provided
-        today = now().date()
+        today = timezone.localdate()
         start_date = parse_date(start_date_str) if start_date_str else today
         end_date = parse_date(end_date_str) if end_date_str else today
 
-        # Normalize to datetime range
-        start_datetime = make_aware(datetime.combine(start_date, datetime.min.time()))
-        end_datetime = make_aware(datetime.combine(end_date, datetime.max.time()))
-
-        return queryset.filter(date__range=(start_datetime, end_datetime)).order_by('-date')
+        # Whole local days, as a half-open range
+        return queryset.filter(periods.between(start_date, end_date).q('date')).order_by('-date')
 
 
 
 
 class StockEntryFilter(django_filters.FilterSet):
-    start_date = django_filters.DateFilter(field_name="date", lookup_expr='gte')
-    end_date = django_filters.DateFilter(field_name="date", lookup_expr='lte')
+    # Half-open datetime bounds on the raw column so the (product, date) index
+    # can be used; end_date includes the whole day.
+    start_date = django_filters.DateFilter(method='filter_start_date')
+    end_date = django_filters.DateFilter(method='filter_end_date')
     product = django_filters.NumberFilter(field_name="product__id")
 
     class Meta:
         model = StockEntry
         fields = ['start_date', 'end_date', 'product']
 
+    def filter_start_date(self, queryset, name, value):
+        return queryset.filter(date__gte=periods.local_midnight(value))
+
+    def filter_end_date(self, queryset, name, value):
+        return queryset.filter(date__lt=periods.local_midnight(value + timedelta(days=1)))
+
+
+class StockEntrySearchFilter(filters.SearchFilter):
+    """Resolve ``?search=`` to ids first instead of ``icontains`` over three joins.
+
+    Matches the same rows as the plain ``icontains`` search on product
+    name, username and batch code: each term is a case-insensitive
+    substring of one of them, and every term must match. Terms of three or
+    more characters are looked up in the in-memory typeahead index
+    (trigrams find every substring); shorter terms, and terms matching more
+    than ``max_products`` products, use an ``icontains`` subquery on the
+    product and batch tables instead. Usernames go through the (small) user
+    table. The ledger itself is then filtered on its indexed foreign keys.
+    """
+    max_products = 500
+
+    def _term_condition(self, term):
+        users = User.objects.filter(username__icontains=term).values('id')
+        if len(term) >= 3:
+            matches = search_index.index.search(term, limit=self.max_products + 1)
+            if len(matches) <= self.max_products:
+                # An exact or partial code hit can hide a name match too
+                by_name = [pid for pid, code in matches
+                           if code is None or search_index.index.name_contains(pid, term)]
+                by_code = [pid for pid, code in matches if code is not None and pid not in by_name]
+                condition = Q(product_id__in=by_name) | Q(recorded_by_id__in=users)
+                if by_code:
+                    # Only the matching batches of those products, not all their entries
+                    condition |= Q(batch_id__in=ProductBatch.objects.filter(
+                        product_id__in=by_code, batch_code__icontains=term
+                    ).values('id'))
+                return condition
+
+        # Too short for trigrams, or too many products to list: let the database match
+        return (
+            Q(product_id__in=Product.objects.filter(name__icontains=term).values('id'))
+            | Q(recorded_by_id__in=users)
+            | Q(batch_id__in=ProductBatch.objects.filter(batch_code__icontains=term).values('id'))
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        search_index.index.ensure_current()
+        for term in terms:
+            queryset = queryset.filter(self._term_condition(term))
+        return queryset
+
+
+class StockEntryCursorPagination(OptInCursorPagination):
+    # Seek paging on (date, id), newest first
+    ordering = ('-date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        # ?ordering=quantity alone isn't unique: break ties on id so pages neither skip nor repeat rows
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
 
 class StockEntryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = StockEntry.objects.all() \
         .select_related('product', 'recorded_by', 'batch') \
-        .order_by('-date')
+        .order_by('-date', '-id')
 
     serializer_class = StockEntrySerializer
+    pagination_class = StockEntryCursorPagination
     filter_backends = [
         DjangoFilterBackend,
         filters.OrderingFilter,
-        filters.SearchFilter
+        StockEntrySearchFilter
     ]
     filterset_class = StockEntryFilter
     search_fields = ['product__name', 'recorded_by__username', 'batch__batch_code']
@@ -656,7 +1360,6 @@ class StockEntryViewSet(viewsets.ReadOnlyModelViewSet):
 
 from django.db.models import Q, Sum, Count, F, ExpressionWrapper, DecimalField
 
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
 from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Q, Count
 from django.utils.timezone import now
 from datetime import timedelta
@@ -668,65 +1371,61 @@ from rest_framework import permissions
 class ReportSummaryAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_report('sales', 'expenses', 'stock')
     def get(self, request):
-        period = request.query_params.get('period', 'daily').lower()
-        today = now().date()
-
-        if period == 'daily':
-            start_date = today
-            trunc_func = TruncDay
-        elif period == 'weekly':
-            start_date = today - timedelta(days=today.weekday())
-            trunc_func = TruncWeek
-        elif period == 'monthly':
-            start_date = today.replace(day=1)
-            trunc_func = TruncMonth
-        elif period == 'yearly':
-            start_date = today.replace(month=1, day=1)
-            trunc_func = TruncYear
-        else:
-            return Response({"error": "Invalid period. Choose from daily, weekly, monthly, yearly."}, status=400)
+        try:
+            period = periods.from_request(request)
+        except periods.PeriodError as e:
+            return Response({"error": str(e)}, status=400)
 
         # Base queries
-        base_sales_qs = Sale.objects.filter(date__date__gte=start_date)
-        sales_qs = base_sales_qs.exclude(status='refunded')
-        expenses_qs = Expense.objects.filter(date__gte=start_date)
-        refunded_sales_qs = base_sales_qs.filter(status='refunded')
-        loan_sales = sales_qs.filter(is_loan=True)
+        sales_qs = Sale.objects.filter(period.q('date'))
+        expenses_qs = Expense.objects.filter(period.q('date'))
 
         remaining_expr = ExpressionWrapper(
             F('total_amount') - F('paid_amount'),
             output_field=DecimalField(max_digits=12, decimal_places=2)
         )
 
-        # Totals
-        total_sales = sales_qs.aggregate(total=Sum('paid_amount'))['total'] or 0
-        wholesaler_sales = sales_qs.filter(sale_type='wholesale').aggregate(total=Sum('paid_amount'))['total'] or 0
-        retailer_sales = sales_qs.filter(sale_type='retail').aggregate(total=Sum('paid_amount'))['total'] or 0
-        total_expenses = expenses_qs.aggregate(total=Sum('amount'))['total'] or 0
-        orders_count = sales_qs.aggregate(count=Count('id'))['count'] or 0
-
-        # Stock value
-        stock_buying = ProductBatch.objects.aggregate(
-            total=Sum(F('quantity') * F('buying_price'))
-        )['total'] or 0
-
-        stock_selling = ProductBatch.objects.aggregate(
-            total=Sum(F('quantity') * F('selling_price'))
-        )['total'] or 0
+        # Row filters shared by the totals and the chart buckets
+        valid_q = ~Q(status='refunded')
+        wholesale_q = valid_q & Q(sale_type='wholesale')
+        retail_q = valid_q & Q(sale_type='retail')
+        loan_paid_q = valid_q & Q(is_loan=True, paid_amount__gt=0)
+        loan_unpaid_q = valid_q & Q(is_loan=True, total_amount__gt=F('paid_amount'))
+        refunded_q = Q(status='refunded')
+
+        # Totals, loan breakdown and refunds in a single pass over Sale
+        totals = sales_qs.aggregate(
+            sales=Sum('paid_amount', filter=valid_q),
+            wholesale=Sum('paid_amount', filter=wholesale_q),
+            retail=Sum('paid_amount', filter=retail_q),
+            orders=Count('id', filter=valid_q),
+            loan_paid=Sum('paid_amount', filter=loan_paid_q),
+            loan_paid_count=Count('id', filter=loan_paid_q),
+            loan_unpaid=Sum(remaining_expr, filter=loan_unpaid_q),
+            loan_unpaid_count=Count('id', filter=loan_unpaid_q),
+            refunds=Sum('total_amount', filter=refunded_q),
+            refund_count=Count('id', filter=refunded_q),
+        )
 
-        # Loan breakdown
-        loan_paid = loan_sales.filter(paid_amount__gt=0)
-        loan_paid_amount = loan_paid.aggregate(total=Sum('paid_amount'))['total'] or 0
-        loan_paid_count = loan_paid.count()
+        total_sales = totals['sales'] or 0
+        wholesaler_sales = totals['wholesale'] or 0
+        retailer_sales = totals['retail'] or 0
+        orders_count = totals['orders'] or 0
+        loan_paid_amount = totals['loan_paid'] or 0
+        loan_paid_count = totals['loan_paid_count'] or 0
+        loan_unpaid_amount = totals['loan_unpaid'] or 0
+        loan_unpaid_count = totals['loan_unpaid_count'] or 0
+        refund_amount = totals['refunds'] or 0
+        refund_count = totals['refund_count'] or 0
 
-        loan_unpaid = loan_sales.annotate(remaining=remaining_expr).filter(remaining__gt=0)
-        loan_unpaid_amount = loan_unpaid.aggregate(total=Sum('remaining'))['total'] or 0
-        loan_unpaid_count = loan_unpaid.count()
+        total_expenses = expenses_qs.aggregate(total=Sum('amount'))['total'] or 0
 
-        # Refunds
-        refund_amount = refunded_sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
-        refund_count = refunded_sales_qs.count()
+        # Stock value (running counters, see valuation.py)
+        stock_value = valuation.snapshot()
+        stock_buying = stock_value['buying']
+        stock_selling = stock_value['selling']
 
         # Profit calculation (confirmed + paid sales only)
         profit_expr = ExpressionWrapper(
@@ -734,68 +1433,30 @@ class ReportSummaryAPIView(APIView):
             output_field=DecimalField(max_digits=12, decimal_places=2)
         )
 
-        wholesale_profit = SaleItem.objects.filter(
-            sale__date__date__gte=start_date,
+        profits = SaleItem.objects.filter(
+            period.q('sale__date'),
             sale__status='confirmed',
-            sale__payment_status='paid',
-            sale__sale_type='wholesale'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
+            sale__payment_status='paid'
+        ).aggregate(
+            wholesale=Sum(profit_expr, filter=Q(sale__sale_type='wholesale')),
+            retail=Sum(profit_expr, filter=Q(sale__sale_type='retail')),
+            net=Sum(profit_expr),
+        )
 
-        retail_profit = SaleItem.objects.filter(
-            sale__date__date__gte=start_date,
-            sale__status='confirmed',
-            sale__payment_status='paid',
-            sale__sale_type='retail'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
+        wholesale_profit = profits['wholesale'] or 0
+        retail_profit = profits['retail'] or 0
+        net_profit = profits['net'] or 0
 
-        net_profit = SaleItem.objects.filter(
-            sale__date__date__gte=start_date,
-            sale__status='confirmed',
-            sale__payment_status='paid'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
-
-        # Time series
-        def group_series(queryset, value_field, label='total'):
-            return queryset.annotate(period=trunc_func('date')).values('period').annotate(
-                total=Sum(value_field)
-            ).order_by('period')
-
-        sales_time_series = group_series(sales_qs, 'paid_amount')
-        expenses_time_series = group_series(expenses_qs, 'amount')
-        loan_paid_time_series = group_series(loan_paid, 'paid_amount')
-        loan_unpaid_time_series = loan_unpaid.annotate(
-            period=trunc_func('date')
-        ).values('period').annotate(
-            remaining=Sum(remaining_expr)
-        ).order_by('period')
-        refund_time_series = group_series(refunded_sales_qs, 'total_amount')
-
-        def fill_series(series_qs):
-            result = {}
-            for item in series_qs:
-                date_key = item['period'].date().isoformat() if hasattr(item['period'], 'date') else str(item['period'])
-                result[date_key] = float(item.get('total') or item.get('remaining') or 0)
-            return result
-
-        sales_data = fill_series(sales_time_series)
-        expenses_data = fill_series(expenses_time_series)
-        loan_paid_data = fill_series(loan_paid_time_series)
-        loan_unpaid_data = fill_series(loan_unpaid_time_series)
-        refund_data = fill_series(refund_time_series)
-
-        all_dates = sorted(set(
-            list(sales_data.keys()) +
-            list(expenses_data.keys()) +
-            list(loan_paid_data.keys()) +
-            list(loan_unpaid_data.keys()) +
-            list(refund_data.keys())
-        ))
-
-        def complete_data(data_dict):
-            return [data_dict.get(date, 0) for date in all_dates]
+        # Time series, every bucket of the period: Sale-based columns come
+        # from the daily rollup, expenses from one grouped query
+        sales_series = list(rollups.rollup_series(period.first_day, period.last_day, period.bucket).values())
+        expenses_series = periods.series(Expense.objects.all(), 'date', period, total=Sum('amount'))
+
+        def column(name):
+            return [float(entry[name]) for entry in sales_series]
 
         return Response({
-            "period": period,
+            "period": period.name,
             "sales": total_sales,
             "wholesalerSales": wholesaler_sales,
             "retailerSales": retailer_sales,
@@ -815,61 +1476,30 @@ class ReportSummaryAPIView(APIView):
             "refundAmount": refund_amount,
             "refundCount": refund_count,
             "chart": {
-                "dates": all_dates,
-                "sales": complete_data(sales_data),
-                "expenses": complete_data(expenses_data),
-                "loanPaid": complete_data(loan_paid_data),
-                "loanUnpaid": complete_data(loan_unpaid_data),
-                "refunds": complete_data(refund_data),
+                "dates": [day.isoformat() for day in period.buckets()],
+                "sales": column('total'),
+                "expenses": [float(entry['total']) for entry in expenses_series.values()],
+                "loanPaid": column('loan_paid'),
+                "loanUnpaid": column('loan_unpaid'),
+                "refunds": column('refunds'),
             }
         })
 
 
-
-
-class RefundViewSet(viewsets.ModelViewSet):
-    queryset = Refund.objects.all()
-    serializer_class = RefundSerializer
-    permission_classes = [IsCashierOrAdmin]
-    filter_backends = [filters.OrderingFilter, filters.SearchFilter]
-    search_fields = ['sale__id', 'refunded_by__username']
-    ordering_fields = ['refund_date', 'refund_amount']
-
-    @transaction.atomic
-    def perform_create(self, serializer):
-        # Just save, model will handle stock and refund_total updates
-        serializer.save(refunded_by=self.request.user)
-
-    @transaction.atomic
-    def perform_update(self, serializer):
-        # Keep it simple, no special handling for update now
-        serializer.save()
-
-    @transaction.atomic
-    def perform_destroy(self, instance):
-        # If you want, handle rollback of stock and refund_total here
-        product = instance.product
-        product.quantity_in_stock -= instance.quantity
-        product.save()
-
-        sale = instance.sale
-        sale.refund_total = (sale.refund_total or 0) - instance.refund_amount
-        sale.save()
-
-        instance.delete()
-
-
-
-
-
 class DashboardMetricsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_report('sales')
     def get(self, request):
-        valid_sales = Sale.objects.exclude(status='refunded')  # 👈 Only real ones
-
-        total_sales = valid_sales.count()
-        total_revenue = valid_sales.aggregate(total=Sum('paid_amount'))['total'] or 0
+        # 👈 Only real ones (the rollup already leaves refunds out)
+        first_day = rollups.first_sale_day()
+        if first_day:
+            totals = rollups.rollup_totals(first_day, periods.resolve('daily').last_day)
+            total_sales = totals['count']
+            total_revenue = totals['total']
+        else:
+            total_sales = 0
+            total_revenue = 0
 
         return Response({
             'total_sales': total_sales,
@@ -881,22 +1511,17 @@ class DashboardMetricsView(APIView):
 class MonthlySalesAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_report('sales')
+    @cached_report('sales')
     def get(self, request):
-        current_year = now().year
-
-        monthly_sales = (
-            Sale.objects
-            .filter(date__year=current_year)
-            .exclude(status='refunded')  # 👈 kill the refunds
-            .annotate(month=ExtractMonth('date'))
-            .values('month')
-            .annotate(total_amount=Sum('paid_amount'))
-            .order_by('month')
-        )
+        year = periods.resolve('yearly')
+
+        # 👈 refunds are already excluded from the rollup totals
+        monthly_sales = rollups.rollup_series(year.first_day, year.last_day, 'month')
 
         sales_data = [0] * 12
-        for entry in monthly_sales:
-            sales_data[entry['month'] - 1] = float(entry['total_amount'] or 0)
+        for month_start, entry in monthly_sales.items():
+            sales_data[month_start.month - 1] = float(entry['total'] or 0)
 
         return Response({"sales": sales_data})
 
@@ -905,45 +1530,21 @@ class MonthlySalesAPIView(APIView):
 class SalesSummaryAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_report('sales')
     def get(self, request):
-        today = now().date()
-        current_year = today.year
-        current_month = today.month
+        month = periods.resolve('monthly')
 
         # --- Current Month Revenue and Sale Count ---
-        current_month_sales = Sale.objects.filter(
-            date__year=current_year,
-            date__month=current_month
-        ).exclude(status='refunded')
-
-        current_month_revenue = current_month_sales.aggregate(
-            total=Sum('paid_amount')
-        )['total'] or 0
-
-        monthly_sales_count = current_month_sales.count()
+        current_month = rollups.rollup_totals(month.first_day, month.last_day)
+        current_month_revenue = current_month['total']
+        monthly_sales_count = current_month['count']
 
         # --- Previous Month Revenue ---
-        if current_month == 1:
-            prev_year = current_year - 1
-            prev_month = 12
-        else:
-            prev_year = current_year
-            prev_month = current_month - 1
-
-        prev_month_revenue = (
-            Sale.objects.filter(
-                date__year=prev_year,
-                date__month=prev_month
-            ).exclude(status='refunded')
-            .aggregate(total=Sum('paid_amount'))['total'] or 0
-        )
+        prev_month = periods.resolve('monthly', today=month.first_day - timedelta(days=1))
+        prev_month_revenue = rollups.rollup_totals(prev_month.first_day, prev_month.last_day)['total']
 
         # --- Today's Revenue ---
-        todays_revenue = (
-            Sale.objects.filter(date__date=today)
-            .exclude(status='refunded')
-            .aggregate(total=Sum('paid_amount'))['total'] or 0
-        )
+        todays_revenue = rollups.rollup_totals(month.last_day, month.last_day)['total']
 
         # --- Progress Percentage ---
         if prev_month_revenue == 0:
@@ -965,6 +1566,7 @@ class SalesSummaryAPIView(APIView):
 class RecentLoginsAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_report('users')
     def get(self, request):
         recent_users = User.objects.filter(last_login__isnull=False).order_by('-last_login')[:5]
         data = [
@@ -977,6 +1579,7 @@ class RecentLoginsAPIView(APIView):
 class RecentSalesAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_report('sales')
     def get(self, request):
         recent_sales = Sale.objects.exclude(status='refunded').order_by('-date')[:5]
         serializer = SaleSerializer(recent_sales, many=True)
@@ -984,114 +1587,156 @@ class RecentSalesAPIView(APIView):
 
 
 
+# Dashboard bundle: all dashboard widgets in one round trip
+from functools import partial
+from .concurrency import fan_out
+
+DASHBOARD_WIDGETS = {
+    'metrics': DashboardMetricsView,
+    'monthly_sales': MonthlySalesAPIView,
+    'sales_summary': SalesSummaryAPIView,
+    'recent_logins': RecentLoginsAPIView,
+    'recent_sales': RecentSalesAPIView,
+}
+DASHBOARD_BUNDLE_MAX_WORKERS = 4
+
+
+def _run_widget(view_class, request):
+    started = time.perf_counter()
+    try:
+        view = view_class()
+        view.request = request
+        view.args, view.kwargs = (), {}
+        view.format_kwarg = None
+        response = view.get(request)
+        result = {"status": response.status_code, "data": response.data}
+    except Exception as e:
+        result = {"status": 500, "error": str(e)}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+class DashboardBundleAPIView(APIView):
+    """Evaluate several dashboard widgets concurrently: ``?widgets=metrics,recent_sales``.
+
+    Authentication and permissions are checked once for the whole bundle.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        raw = request.query_params.get('widgets')
+        names = [n.strip() for n in raw.split(',') if n.strip()] if raw else list(DASHBOARD_WIDGETS)
+        names = list(dict.fromkeys(names))
+
+        unknown = [n for n in names if n not in DASHBOARD_WIDGETS]
+        if unknown:
+            return Response({
+                "error": f"Unknown widget(s): {', '.join(unknown)}.",
+                "available": list(DASHBOARD_WIDGETS),
+            }, status=400)
+
+        started = time.perf_counter()
+        widgets = fan_out(
+            {name: partial(_run_widget, DASHBOARD_WIDGETS[name], request) for name in names},
+            max_workers=DASHBOARD_BUNDLE_MAX_WORKERS,
+        )
+
+        return Response({
+            "widgets": widgets,
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+
+
+
 # StockReportAPIView
 class StockReportAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    # Run the independent report sections concurrently (see concurrency.py)
+    parallel_queries = True
 
+    @conditional_report('sales', 'stock')
+    @cached_report('sales', 'stock')
     def get(self, request):
-        period = request.query_params.get('period', 'daily').lower()
-        today = now().date()
+        # Charts look back 30 days / 12 weeks / 1 year / 5 years
+        try:
+            period = periods.from_request(request, trailing=True)
+        except periods.PeriodError as e:
+            return Response({"error": str(e)}, status=400)
+        today = period.last_day
         soon_expiry_days = 180
         soon_expiry_date = today + timedelta(days=soon_expiry_days)
 
-        # Period trunc function & start_date for time series
-        if period == 'daily':
-            trunc_func = TruncDay
-            start_date = today - timedelta(days=30)
-        elif period == 'weekly':
-            trunc_func = TruncWeek
-            start_date = today - timedelta(weeks=12)
-        elif period == 'monthly':
-            trunc_func = TruncMonth
-            start_date = (today.replace(day=1) - timedelta(days=365))  # 1 year back
-        elif period == 'yearly':
-            trunc_func = TruncYear
-            start_date = (today.replace(month=1, day=1) - timedelta(days=365*5))  # 5 years back
-        else:
-            return Response({"error": "Invalid period. Choose from daily, weekly, monthly, yearly."}, status=400)
-
         # Total stock quantity
-        total_stock_qty = ProductBatch.objects.aggregate(
-            total_qty=Coalesce(Sum('quantity'), 0)
-        )['total_qty']
+        total_stock_qty = valuation.snapshot()['quantity']
 
         # --- EXPIRED and SOON EXPIRING batches (full details) ---
-        expired_batches = ProductBatch.objects.filter(
-            expiry_date__lt=today,
-            quantity__gt=0
-        ).select_related('product').values(
-            'id', 'batch_code', 'expiry_date', 'quantity', 'buying_price', 'product__id', 'product__name'
-        )
-
-        soon_expiring_batches = ProductBatch.objects.filter(
-            expiry_date__gte=today,
-            expiry_date__lt=soon_expiry_date,
-            quantity__gt=0
-        ).select_related('product').values(
-            'id', 'batch_code', 'expiry_date', 'quantity', 'product__id', 'product__name'
-        )
-
-        # Calculate total loss from expired stock
-        total_expired_loss = 0
-        for batch in expired_batches:
-            total_expired_loss += float(batch['buying_price']) * batch['quantity']
-
-        # --- LOW STOCK PRODUCTS (full details) ---
-        low_stock_products = Product.objects.annotate(
-            total_stock=Coalesce(Sum('batches__quantity'), 0)
-        ).filter(total_stock__lte=F('threshold')).values(
-            'id', 'name', 'threshold', 'total_stock'
-        )
+        def expired_batches():
+            return list(ProductBatch.objects.filter(
+                expiry_date__lt=today,
+                quantity__gt=0
+            ).values(
+                'id', 'batch_code', 'expiry_date', 'quantity', 'buying_price', 'product__id', 'product__name'
+            ))
+
+        def soon_expiring_batches():
+            return list(ProductBatch.objects.filter(
+                expiry_date__gte=today,
+                expiry_date__lt=soon_expiry_date,
+                quantity__gt=0
+            ).values(
+                'id', 'batch_code', 'expiry_date', 'quantity', 'product__id', 'product__name'
+            ))
 
         # --- MOST SOLD ITEMS ---
-        most_sold_qs = SaleItem.objects.filter(
-            sale__status='confirmed',
-            sale__date__date__gte=start_date
-        ).values('product__id', 'product__name').annotate(
-            total_sold=Coalesce(Sum('quantity'), 0)
-        ).order_by('-total_sold')[:10]
+        def most_sold():
+            return list(SaleItem.objects.filter(
+                period.q('sale__date'),
+                sale__status='confirmed',
+            ).values('product__id', 'product__name').annotate(
+                total_sold=Coalesce(Sum('quantity'), 0)
+            ).order_by('-total_sold')[:10])
 
         # --- STOCK MOVEMENT TIME SERIES ---
-        restock_qs = StockEntry.objects.filter(
-            date__date__gte=start_date,
-            entry_type__in=['added', 'returned']
-        ).annotate(period=trunc_func('date')).values('period').annotate(
-            total=Coalesce(Sum('quantity'), 0)
-        ).order_by('period')
-
-        sales_qs = SaleItem.objects.filter(
-            sale__status='confirmed',
-            sale__date__date__gte=start_date
-        ).annotate(period=trunc_func('sale__date')).values('period').annotate(
-            total=Coalesce(Sum('quantity'), 0)
-        ).order_by('period')
+        def restocks():
+            return periods.series(
+                StockEntry.objects.filter(entry_type__in=['added', 'returned']),
+                'date', period, total=Sum('quantity'),
+            )
 
-        def qs_to_dict(qs):
-            d = {}
-            for e in qs:
-                dt = e['period']
-                key = dt.date().isoformat() if hasattr(dt, 'date') else str(dt)
-                d[key] = e['total']
-            return d
+        def sold():
+            return periods.series(
+                SaleItem.objects.filter(sale__status='confirmed'),
+                'sale__date', period, total=Sum('quantity'),
+            )
 
-        restocks_data = qs_to_dict(restock_qs)
-        sales_data = qs_to_dict(sales_qs)
+        # The sections are independent, so they run side by side
+        results = fan_out({
+            'expired': expired_batches,
+            'soon_expiring': soon_expiring_batches,
+            'low_stock': lowstock.low_stock_products,
+            'most_sold': most_sold,
+            'restocks': restocks,
+            'sold': sold,
+        }, parallel=self.parallel_queries)
 
-        all_dates = sorted(set(list(restocks_data.keys()) + list(sales_data.keys())))
+        # Calculate total loss from expired stock
+        total_expired_loss = 0
+        for batch in results['expired']:
+            total_expired_loss += float(batch['buying_price']) * batch['quantity']
 
         response = {
-            "period": period,
+            "period": period.name,
             "totalStockQty": total_stock_qty,
-            "expiredBatches": list(expired_batches),
-            "soonExpiringBatches": list(soon_expiring_batches),
-            "lowStockProducts": list(low_stock_products),
-            "mostSoldItems": list(most_sold_qs),
+            "expiredBatches": results['expired'],
+            "soonExpiringBatches": results['soon_expiring'],
+            "lowStockProducts": results['low_stock'],
+            "mostSoldItems": results['most_sold'],
             "stockMovement": [
                 {
-                    "date": date,
-                    "Restocked": restocks_data.get(date, 0),
-                    "Sold": sales_data.get(date, 0),
-                } for date in all_dates
+                    "date": day.isoformat(),
+                    "Restocked": results['restocks'][day]['total'],
+                    "Sold": results['sold'][day]['total'],
+                } for day in period.buckets()
             ],
             "totalExpiredLoss": round(total_expired_loss, 2),
         }
@@ -1099,24 +1744,49 @@ class StockReportAPIView(APIView):
         return Response(response)
 
 
+class LowStockFeedAPIView(APIView):
+    """Threshold crossings since ``?since=<seq>``, so the stock page can poll for changes only."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+        except (TypeError, ValueError):
+            return Response({"error": "since must be an integer."}, status=400)
+
+        # resync: the client fell too far behind (or the feed was reset) and must reload the list
+        latest, events, resync = lowstock.feed(since)
+        return Response({"latest": latest, "events": events, "resync": resync})
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def edit_batch(request, product_id, batch_id):
     try:
-        batch = ProductBatch.objects.get(id=batch_id, product_id=product_id)
+        batch = ProductBatch.objects.select_for_update().get(id=batch_id, product_id=product_id)
     except ProductBatch.DoesNotExist:
         return Response({'error': 'Batch not found.'}, status=status.HTTP_404_NOT_FOUND)
 
     data = request.data
 
+    # Quantity goes through the inventory service as a logged adjustment
+    if data.get('quantity') is not None:
+        try:
+            quantity = int(data['quantity'])
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid quantity.'}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity < 0:
+            return Response({'error': 'Quantity cannot be negative.'}, status=status.HTTP_400_BAD_REQUEST)
+        inventory.adjust([(batch, quantity - batch.quantity)], request.user)
+
     # Update fields if they exist in the request
     batch.expiry_date = data.get('expiry_date', batch.expiry_date)
-    batch.quantity = data.get('quantity', batch.quantity)
     batch.buying_price = data.get('buying_price', batch.buying_price)
     batch.selling_price = data.get('selling_price', batch.selling_price)
     batch.wholesale_price = data.get('wholesale_price', batch.wholesale_price)
 
-    batch.save()
+    batch.save(update_fields=['expiry_date', 'buying_price', 'selling_price', 'wholesale_price'])
 
     return Response({'message': 'Batch updated successfully.'})
 
@@ -1128,194 +1798,299 @@ def edit_batch(request, product_id, batch_id):
 
 ## Profit Report View
 from main.models import SaleItem
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import NullIf
 class ProfitReportView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @cached_report('sales', 'stock')
     def get(self, request):
-        period = request.query_params.get('period', 'daily').lower()
-        now = timezone.now()
-
-        if period == 'daily':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        elif period == 'weekly':
-            start_date = now - timedelta(days=7)
-        elif period == 'monthly':
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        elif period == 'yearly':
-            start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        else:
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            period = periods.from_request(request)
+        except periods.PeriodError as e:
+            return Response({"error": str(e)}, status=400)
+
+        money = DecimalField(max_digits=24, decimal_places=6)
+
+        line_selling = ExpressionWrapper(F('quantity') * F('batch__selling_price'), output_field=money)
+        line_buying = ExpressionWrapper(F('quantity') * F('batch__buying_price'), output_field=money)
+
+        # Undiscounted total of every sale, used to spread paid_amount across its items
+        sale_total = Subquery(
+            SaleItem.objects.filter(sale_id=OuterRef('sale_id'))
+            .values('sale_id')
+            .annotate(total=Sum(line_selling))
+            .values('total'),
+            output_field=money,
+        )
 
-        # Load only confirmed sales
-        sale_items = SaleItem.objects.select_related('sale', 'batch', 'product').filter(
-            sale__status='confirmed',
-            sale__date__gte=start_date
+        # Each item's share of what was actually paid: quantity * selling_price / sale_total * paid_amount
+        discounted_selling = ExpressionWrapper(
+            line_selling * F('sale__paid_amount') / NullIf(sale_total, Value(Decimal('0'))),
+            output_field=money,
         )
 
-        # Precompute sale total per sale_id
-        sale_totals = {}
-        for item in sale_items:
-            sale_id = item.sale_id
-            if sale_id not in sale_totals:
-                sale_totals[sale_id] = Decimal('0.00')
-            sale_totals[sale_id] += Decimal(item.quantity) * item.batch.selling_price
+        # Load only confirmed sales
+        product_rows = (
+            SaleItem.objects
+            .filter(period.q('sale__date'), sale__status='confirmed')
+            .values('product__name')
+            .annotate(
+                selling_total=Sum(discounted_selling),
+                buying_total=Sum(line_buying),
+            )
+            .order_by('product__name')
+        )
 
         total_selling = Decimal('0.00')
         total_buying = Decimal('0.00')
-        total_profit = Decimal('0.00')
-        product_summary = {}
-
-        for item in sale_items:
-            sale = item.sale
-            batch = item.batch
-            product_name = item.product.name
-            sale_total = sale_totals[item.sale_id] or Decimal('0.00')
+        products_list = []
 
-            item_selling_price = Decimal(item.quantity) * batch.selling_price
-            proportion = item_selling_price / sale_total if sale_total > 0 else Decimal('0.00')
-            discounted_selling = proportion * sale.paid_amount  # use paid_amount
+        for row in product_rows:
+            selling = row['selling_total'] or Decimal('0.00')
+            buying = row['buying_total'] or Decimal('0.00')
+            total_selling += selling
+            total_buying += buying
 
-            buying = Decimal(item.quantity) * batch.buying_price
-            profit = discounted_selling - buying
+            products_list.append({
+                'name': row['product__name'],
+                'selling_total': round_two(selling),
+                'buying_total': round_two(buying),
+                'profit': round_two(selling - buying),
+            })
 
-            total_selling += discounted_selling
-            total_buying += buying
-            total_profit += profit
-
-            if product_name not in product_summary:
-                product_summary[product_name] = {
-                    'selling_total': Decimal('0.00'),
-                    'buying_total': Decimal('0.00'),
-                    'profit': Decimal('0.00'),
-                }
-
-            product_summary[product_name]['selling_total'] += discounted_selling
-            product_summary[product_name]['buying_total'] += buying
-            product_summary[product_name]['profit'] += profit
-
-        products_list = [
-            {
-                'name': name,
-                'selling_total': values['selling_total'],
-                'buying_total': values['buying_total'],
-                'profit': values['profit'],
-            }
-            for name, values in product_summary.items()
-        ]
+        total_profit = total_selling - total_buying
 
         return Response({
-            'stockSelling': total_selling,
-            'stockBuying': total_buying,
-            'profit': total_profit,
+            'stockSelling': round_two(total_selling),
+            'stockBuying': round_two(total_buying),
+            'profit': round_two(total_profit),
             'products': products_list,
         })
 
 
 
 # Wholesale Report View
-import pytz
-EAT = pytz.timezone("Africa/Nairobi")
+from django.utils.dateparse import parse_datetime
 class WholesaleReportAPIView(APIView):
-    def get(self, request):
-        now_utc = timezone.now()
-        now_eat = now_utc.astimezone(EAT)
+    page_size = 100
+    max_page_size = 500
 
-        period = request.GET.get("period", "daily")
-        start = request.GET.get("start")
-        end = request.GET.get("end")
+    def get(self, request):
         user_id = request.GET.get("user_id")
 
-        orders = Order.objects.filter(order_type='wholesale', status='confirmed')
+        # The custom range is filled in by the user; until both ends are there, nothing to show
+        if request.GET.get("period") == "custom" and not (request.GET.get("start") and request.GET.get("end")):
+            return Response({"custom": [], "totals": self.empty_totals(), "next": None})
+        try:
+            period = periods.from_request(request, allow_custom=True)
+        except periods.PeriodError as e:
+            return Response({"error": str(e)}, status=400)
+
+        # Only the requested period is computed
+        orders = Order.objects.filter(period.q('created_at'), order_type='wholesale', status='confirmed')
         if user_id:
             orders = orders.filter(user_id=user_id)
 
-        def serialize(qs):
-            result = []
-            for o in qs:
-                created_at_eat = o.created_at.astimezone(EAT)
-                total = float(o.sale.paid_amount) if hasattr(o, 'sale') else 0
-                profit = total * 0.15  # You can replace with actual logic
-
-                result.append({
-                    "id": o.id,
-                    "user": o.user.username if o.user else "Unknown",
-                    "customer": o.customer.name if o.customer else "",
-                    "date": created_at_eat.strftime("%Y-%m-%d %H:%M"),
-                    "discount": float(o.discount_percent),
-                    "total": total,
-                    "profit": profit,
-                })
-            return result
-
-        if period == "custom":
-            start_date = parsedate(start)
-            end_date = parsedate(end)
-            if start_date and end_date:
-                qs = orders.filter(created_at__date__gte=start_date, created_at__date__lte=end_date)
-                return Response({"custom": serialize(qs)})
-            else:
-                return Response({"custom": []})
+        money = DecimalField(max_digits=24, decimal_places=2)
+        batch_cost = Subquery(
+            SaleItem.objects.filter(sale_id=OuterRef('sale__id'))
+            .values('sale_id')
+            .annotate(cost=Sum(ExpressionWrapper(F('quantity') * F('batch__buying_price'), output_field=money)))
+            .values('cost'),
+            output_field=money,
+        )
+        orders = orders.annotate(
+            paid=Coalesce(F('sale__paid_amount'), Value(Decimal('0.00')), output_field=money),
+            cost=Coalesce(batch_cost, Value(Decimal('0.00')), output_field=money),
+        ).annotate(
+            profit=ExpressionWrapper(F('paid') - F('cost'), output_field=money),
+        )
 
-        filters = {
-            "daily": orders.filter(created_at__date=now_eat.date()),
-            "weekly": orders.filter(created_at__gte=now_utc - timedelta(days=7)),
-            "monthly": orders.filter(created_at__month=now_eat.month, created_at__year=now_eat.year),
-            "yearly": orders.filter(created_at__year=now_eat.year),
-        }
+        totals = orders.aggregate(
+            count=Count('id'),
+            total=Sum('paid'),
+            discount=Sum('discount_percent'),
+            profit=Sum('profit'),
+        )
+
+        # Keyset pagination on (created_at, id), newest first
+        try:
+            limit = min(int(request.GET.get("limit", self.page_size)), self.max_page_size)
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid limit."}, status=400)
+        if limit <= 0:
+            return Response({"error": "Invalid limit."}, status=400)
+
+        cursor = request.GET.get("cursor")
+        page = orders.select_related('user', 'customer').order_by('-created_at', '-id')
+        if cursor:
+            created_at, _, last_id = cursor.rpartition("_")
+            created_at = parse_datetime(created_at)
+            if created_at is None or not last_id.isdigit():
+                return Response({"error": "Invalid cursor."}, status=400)
+            page = page.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=int(last_id))
+            )
+
+        rows = list(page[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].created_at.isoformat()}_{rows[-1].id}" if has_more else None
+
+        result = []
+        for o in rows:
+            created_at_local = timezone.localtime(o.created_at)
+            result.append({
+                "id": o.id,
+                "user": o.user.username if o.user else "Unknown",
+                "customer": o.customer.name if o.customer else "",
+                "date": created_at_local.strftime("%Y-%m-%d %H:%M"),
+                "discount": float(o.discount_percent),
+                "total": float(o.paid),
+                "profit": float(o.profit),
+            })
+
+        return Response({
+            period.name: result,
+            "totals": {
+                "count": totals['count'] or 0,
+                "total": float(totals['total'] or 0),
+                "discount": float(totals['discount'] or 0),
+                "profit": float(totals['profit'] or 0),
+            },
+            "next": next_cursor,
+        })
 
-        return Response({key: serialize(qs) for key, qs in filters.items()})
+    @staticmethod
+    def empty_totals():
+        return {"count": 0, "total": 0.0, "discount": 0.0, "profit": 0.0}
 
 
 
 
 #SHORT REPORT VIEW
+from itertools import chain
+from django.http import StreamingHttpResponse
 from django.utils.timezone import now
 from django.utils.timezone import make_aware
 from datetime import timedelta, datetime
 from django.db.models.functions import TruncDate
-from django.db.models import Sum, Count, Case, When, Value
+from django.db.models import Sum, Count, Case, When
+from rest_framework import renderers
+from rest_framework.settings import api_settings
 from .models import Order  # or your actual import path
 from .models import Sale    # make sure you import Sale directly
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer: hands each line straight back to the caller."""
+    def write(self, value):
+        return value
+
+
+class StreamRenderer(renderers.BaseRenderer):
+    # Only used for content negotiation on ?format=...; streamed bodies
+    # bypass it, error responses are rendered as JSON.
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, default=str).encode(self.charset)
+
+
+class CSVStreamRenderer(StreamRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONStreamRenderer(StreamRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+SHORT_REPORT_COLUMNS = ["date", "total_sales", "retail_sales", "wholesale_sales", "sales_count"]
+
+
+def short_report_row(day, entry):
+    return {
+        "date": day.isoformat(),
+        "total_sales": float(entry["total"] or 0),
+        "retail_sales": float(entry["retail"] or 0),
+        "wholesale_sales": float(entry["wholesale"] or 0),
+        "sales_count": entry["count"],
+    }
+
+
 class ShortReportView(APIView):
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [CSVStreamRenderer, NDJSONStreamRenderer]
+
+    @cached_report('sales')
     def get(self, request):
         start = request.GET.get('start')
         end = request.GET.get('end')
+        export = request.GET.get('format')
 
         if not start or not end:
             return Response({"error": "Start and end dates are required."}, status=400)
 
-        start_date = parse_date(start)
-        end_date = parse_date(end)
+        try:
+            period = periods.resolve('custom', start, end, allow_custom=True)
+        except periods.PeriodError:
+            return Response({"error": "Invalid date range."}, status=400)
+        start_date, end_date = period.first_day, period.last_day
+
+        if export in ('csv', 'ndjson'):
+            return self.stream(start_date, end_date, export)
+
+        sorted_report = [
+            short_report_row(day, entry)
+            for day, entry in rollups.daily_rollup(start_date, end_date).items()
+            if entry["count"]
+        ]
 
-        sales = Sale.objects.filter(
-            date__date__range=(start_date, end_date),
-        ).exclude(status='refunded')
+        return Response({
+            "start_date": start,
+            "end_date": end,
+            "report": sorted_report
+        })
 
-        grouped = {}
+    def stream(self, start_date, end_date, export):
+        # Grouped on the database side and read with a server-side cursor,
+        # so a year-long export never holds more than one day in memory.
+        rows = (
+            short_report_row(row['day'], row)
+            for row in rollups.grouped_days(start_date, end_date).iterator()
+            if row['count']
+        )
 
-        for sale in sales:
-            day = sale.date.date().isoformat()
-            if day not in grouped:
-                grouped[day] = {
-                    "date": day,
-                    "total_sales": 0,
-                    "retail_sales": 0,
-                    "wholesale_sales": 0,
-                    "sales_count": 0,
-                }
+        if export == 'csv':
+            writer = csv.writer(Echo())
+            lines = ([row[column] for column in SHORT_REPORT_COLUMNS] for row in rows)
+            body = (writer.writerow(line) for line in chain([SHORT_REPORT_COLUMNS], lines))
+            content_type = 'text/csv'
+        else:
+            body = (json.dumps(row) + "\n" for row in rows)
+            content_type = 'application/x-ndjson'
 
-            grouped[day]["total_sales"] += float(sale.paid_amount)
-            grouped[day]["sales_count"] += 1
+        response = StreamingHttpResponse(body, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="short-report-{start_date}-{end_date}.{export}"'
+        )
+        return response
 
-            if sale.sale_type == "retail":
-                grouped[day]["retail_sales"] += float(sale.paid_amount)
-            elif sale.sale_type == "wholesale":
-                grouped[day]["wholesale_sales"] += float(sale.paid_amount)
 
-        sorted_report = sorted(grouped.values(), key=lambda x: x["date"])
+from django.http import HttpResponse
+from . import metrics
 
-        return Response({
-            "start_date": start,
-            "end_date": end,
-            "report": sorted_report
-        })
\ No newline at end of file
+
+class MetricsView(APIView):
+    """Request/SQL metrics from RequestMetricsMiddleware in Prometheus text format (``/api/metrics``)."""
+
+    def get_permissions(self):
+        # Scrapers send X-Metrics-Token (REQUEST_METRICS_TOKEN), people need to be admins
+        if metrics.scrape_token_ok(self.request):
+            return []
+        return [IsAdminOnly()]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")